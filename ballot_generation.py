@@ -5,8 +5,10 @@ from prefsampling.approval import impartial, urn, resampling
 from prefsampling.ordinal import impartial as impartial_ordinal, urn as urn_ordinal
 
 # IABC
-from basics_and_helpers import random_number_between
+from basics_and_helpers import random_number_between, sampling_seed
+from batch_generation import draw_profile
 from types_classes import Parameters
+from bitmasks import BallotProfile
 
 # CUTOFF BALLOTS
 # cannot use truncated_ordinal as we need the original ordinal profile for comparisons
@@ -66,23 +68,21 @@ def voter_interval(num_voters,num_candidates,avg_size,skip_empty_ballots):
     return [ballot_from_support_sets(i,support_sets,skip_empty_ballots) for i in range(num_voters)]
 
 
-# GENERAL BALLOT GENERATION
-# generate ballots from given parameters
-def generate_ballots(params:Parameters,index:int):
+# REFERENCE BALLOT GENERATION
+# generate one profile from given parameters (culture not manual) with prefsampling and the generators above
+# reference for the vectorized batch generation used in simulations (see batch_generation.py)
+# prefsampling cultures are seeded from the election's random stream if elections are seeded (see sampling_seed)
+def reference_profile(params:Parameters):
     # set candidate approval probability p to k/m * avg_ballot_size
-    if not params.ballot_generation.ordinal and not params.ballot_generation.culture == "manual":
+    if not params.ballot_generation.ordinal:
         p = params.abcvoting.k/params.abcvoting.m * params.ballot_generation.avg_ballot_size
     # generate preferences and ballots according to parameters
     if params.ballot_generation.ordinal:
         match params.ballot_generation.culture:
             case "impartial":
-                preferences_truthful = impartial_ordinal(num_voters=params.abcvoting.n, num_candidates=params.abcvoting.m)
-            case "mallows":
-                preferences_truthful = mallows(num_voters=params.abcvoting.n, num_candidates=params.abcvoting.m, phi=params.ballot_generation.phi)
+                preferences_truthful = impartial_ordinal(num_voters=params.abcvoting.n, num_candidates=params.abcvoting.m, seed=sampling_seed())
             case "urn":
-                preferences_truthful = urn_ordinal(num_voters=params.abcvoting.n,num_candidates=params.abcvoting.m,alpha=params.ballot_generation.alpha)
-            case "manual":
-                preferences_truthful = params.ballot_generation.manual_preference[index]
+                preferences_truthful = urn_ordinal(num_voters=params.abcvoting.n,num_candidates=params.abcvoting.m,alpha=params.ballot_generation.alpha, seed=sampling_seed())
         if params.ballot_generation.random_cutoff:
             ballots_truthful = cutoff_from_ordinal_r(preferences_truthful,params.abcvoting.k*params.ballot_generation.avg_ballot_size,params.ballot_generation.skip_empty_ballots)
         else:
@@ -92,18 +92,44 @@ def generate_ballots(params:Parameters,index:int):
         preferences_truthful = None
         match params.ballot_generation.culture:
             case "impartial":
-                ballots_truthful = impartial(num_voters=params.abcvoting.n, num_candidates=params.abcvoting.m, p=p)
+                ballots_truthful = impartial(num_voters=params.abcvoting.n, num_candidates=params.abcvoting.m, p=p, seed=sampling_seed())
             case "resampling":
-                ballots_truthful = resampling(num_voters=params.abcvoting.n, num_candidates=params.abcvoting.m, phi=params.ballot_generation.phi, rel_size_central_vote=p)
+                ballots_truthful = resampling(num_voters=params.abcvoting.n, num_candidates=params.abcvoting.m, phi=params.ballot_generation.phi, rel_size_central_vote=p, seed=sampling_seed())
             case "urn":
-                ballots_truthful = urn(num_voters=params.abcvoting.n, num_candidates=params.abcvoting.m, p=p, alpha=params.ballot_generation.alpha)
+                ballots_truthful = urn(num_voters=params.abcvoting.n, num_candidates=params.abcvoting.m, p=p, alpha=params.ballot_generation.alpha, seed=sampling_seed())
             case "candidate_interval":
                 ballots_truthful = candidate_interval(num_voters=params.abcvoting.n, num_candidates=params.abcvoting.m,avg_size=params.abcvoting.k*params.ballot_generation.avg_ballot_size,skip_empty_ballots=params.ballot_generation.skip_empty_ballots)
             case "voter_interval":
                 ballots_truthful = voter_interval(num_voters=params.abcvoting.n, num_candidates=params.abcvoting.m,avg_size=params.abcvoting.k*params.ballot_generation.avg_ballot_size,skip_empty_ballots=params.ballot_generation.skip_empty_ballots)
-            case "manual":
-                ballots_truthful = params.ballot_generation.manual_ballots[index]
-    # regenerate ballots and preferences if empty set contained
+    return (preferences_truthful, ballots_truthful)
+
+# regenerate ballots and preferences while an empty set is contained (whole-profile rejection)
+def reference_ballots(params:Parameters):
+    preferences_truthful, ballots_truthful = reference_profile(params)
+    while params.ballot_generation.skip_empty_ballots and set() in ballots_truthful:
+        preferences_truthful, ballots_truthful = reference_profile(params)
+    return (preferences_truthful, ballots_truthful)
+
+
+# GENERAL BALLOT GENERATION
+# generate preferences, truthful profile (BallotProfile) and number of ballots sampled for it (None for manual profiles)
+# generated cultures are drawn from vectorized batches (see batch_generation.py), manual profiles are taken from the parameters
+def generate_ballots(params:Parameters,index:int):
+    if not params.ballot_generation.culture == "manual":
+        return draw_profile(params)
+    # manual preferences and ballots
+    if params.ballot_generation.ordinal:
+        preferences_truthful = params.ballot_generation.manual_preference[index]
+        if params.ballot_generation.random_cutoff:
+            ballots_truthful = cutoff_from_ordinal_r(preferences_truthful,params.abcvoting.k*params.ballot_generation.avg_ballot_size,params.ballot_generation.skip_empty_ballots)
+        else:
+            ballots_truthful = cutoff_from_ordinal(preferences_truthful,params.ballot_generation.cutoff_points)
+        preferences_truthful = to_int_profile(preferences_truthful)
+    else:
+        preferences_truthful = None
+        ballots_truthful = params.ballot_generation.manual_ballots[index]
+    # random cutoffs are never empty if skip_empty_ballots, all other manual ballots would be regenerated identically
     if params.ballot_generation.skip_empty_ballots and set() in ballots_truthful:
-        return generate_ballots(params,index)
-    return (preferences_truthful, ballots_truthful)
\ No newline at end of file
+        print("\033[91mManual profile " + str(index) + " contains an empty ballot (skip_empty_ballots)\033[0m")
+        raise ValueError
+    return (preferences_truthful, BallotProfile.from_ballots(ballots_truthful,params.abcvoting.m), None)
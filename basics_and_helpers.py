@@ -1,7 +1,10 @@
 # basic
-import sys
+import sys, hashlib
+import random as py_random
+import numpy as np
 import numpy.random as random
 from itertools import chain, combinations
+from math import fsum
 
 # caching (memoisation)
 from functools import lru_cache
@@ -10,6 +13,9 @@ from functools import lru_cache
 from abcvoting.preferences import Profile
 from abcvoting import abcrules
 from types_classes import *
+from bitmasks import approval_matrix, candidates, committee_masks, popcount, profile_key, to_mask
+from rules import NATIVE_RULES, compute_rule
+import shared_cache, persistent_cache
 
 # HELPER FUNCTIONS
 # powerset
@@ -21,14 +27,6 @@ def powerset(iterable):
 def get_subsets_len_k(input_set:set,k:int):
     return list(map(set,combinations(input_set,k)))
 
-# convert ballot profile to tuple of frozensets to make it hashable
-def hashable_set_list(set_list:list[set]):
-    return tuple(map(frozenset,set_list))
-
-# convert ballot profile to sorted tuple of frozensets to make it hashable
-def hashable_sorted_set_list(set_list:list[set]):
-    return hashable_set_list(sorted(map(sorted,set_list),key=lambda x: tuple(iter(x))))
-
 # count non-zero elements in list, returns 1 if empty to avoid division by zero
 def len_nonzero(l):
     l = len([1 for x in l if x != 0])
@@ -40,6 +38,29 @@ def random_number_between(a,b,m,s):
     num = round(random.normal(m,s))
     return max(a,min(b,num))
 
+# RANDOM STREAMS
+# reproducible runs (ExecutionParams.seed): each election draws from its own streams derived from (master seed, configuration, election index),
+# results do not depend on the worker, the order of the tasks or the shard that runs the election
+# (python random: intervals, shuffled deviation ballots; numpy: ballot sizes, random iteration lists; prefsampling: seeds drawn from numpy)
+election_seeded = False
+
+# stable key of the parameters that determine the elections of a configuration (not num_elections, filename, trace and execution)
+def configuration_key(params:Parameters) -> int:
+    config = (params.ballot_generation,params.abcvoting,params.iteration,params.deviation)
+    return int.from_bytes(hashlib.blake2b(repr(config).encode(),digest_size=16).digest(),"little")
+
+# seed the random streams of election index (python random and numpy are global per worker)
+def seed_election(seed, configuration, index):
+    global election_seeded
+    state = np.random.SeedSequence([seed,configuration,index]).generate_state(2)
+    py_random.seed(int(state[0]))
+    random.seed(int(state[1]))
+    election_seeded = True
+
+# seed for a prefsampling call, None (fresh entropy) if elections are not seeded
+def sampling_seed():
+    return int(random.randint(0,2**32)) if election_seeded else None
+
 # print election ballots and winning committee
 # optional: custom string, file specifier and color
 def print_election(ballots, W, add_str = "", io = sys.stdout, color = "\033[0m"):
@@ -59,46 +80,80 @@ def cycle_list(l, n):
 
 # COMMITTEE COMPUTATION
 # generalised Thiele rule (experimental for finding cycles, not fully implemented for simulations)
+# ballots and committee W as bitmasks
+# fsum: exactly rounded, score does not depend on the order of the ballots in the (anonymous) cache key
 def score_thiele(score_vector,ballots,W):
-    return sum([sum(score_vector[:len(A.intersection(W))]) for A in ballots])
+    return fsum([sum(score_vector[:popcount(A & W)]) for A in ballots])
 
 w_small = [1,0.1,0.01,0.001,0.0001,0.00001,0.000001,0.0000001,0.00000001]
 w_large = [1,0.99999999,0.9999999,0.999999,0.99999,0.9999,0.999,0.99,0.9]
 w_pav = [1,1/2,1/3,1/4,1/5,1/6,1/7,1/8,1/9]
 
-@lru_cache(maxsize=100000)
+# all committees of size k (bitmasks, lexicographic order) and their m x committees membership matrix
+@lru_cache(maxsize=100)
+def committee_matrix(m,k):
+    committees = committee_masks(m,k)
+    return committees, approval_matrix(committees,m).T.astype(np.int32)
+
+# number of voters with intersection size s = 0,...,k for every committee ((k+1) x committees)
+# computed in one batch: approval matrix times membership matrix gives all intersection sizes
+def intersection_histogram(m,k,ballots):
+    _, members = committee_matrix(m,k)
+    sizes = approval_matrix(ballots,m).astype(np.int32) @ members
+    return np.stack([(sizes == s).sum(axis=0) for s in range(k+1)])
+
+# Thiele scores of all committees for each weight vector (committees x weight vectors)
+# score of a voter with intersection size s is the sum of the first s weights
+def thiele_scores(histogram,score_vectors):
+    k = histogram.shape[0]-1
+    cumulative = np.array([[sum(w[:s]) for w in score_vectors] for s in range(k+1)])
+    return histogram.T @ cumulative
+
 def compute_thiele(m,k,ballots):
-    committees = sorted(get_subsets_len_k(range(m),k),key=lambda x: tuple(iter(x)))
-    W_small = max(committees,key=lambda W:score_thiele(w_small,ballots,W))
-    W_large = max(committees,key=lambda W:score_thiele(w_large,ballots,W))
-    if W_small == W_large:
-        return frozenset(W_small), (len([W for W in committees if score_thiele(w_small,ballots,W) == score_thiele(w_small,ballots,W_small)]) != 1)
+    committees, _ = committee_matrix(m,k)
+    # one pass: scores for w_small and w_large, argmax picks lexicographically first committee
+    scores = thiele_scores(intersection_histogram(m,k,ballots),[w_small,w_large])
+    i_small, i_large = np.argmax(scores,axis=0)
+    if i_small == i_large:
+        return committees[i_small], bool(np.count_nonzero(scores[:,0] == scores[i_small,0]) != 1)
     else:
         return None, True
 
-# computes winning committees
-# optimisation: memoized
-# can only be used with hashable ballots (frozensets)
-# returns (hashable) sorted tuple of frozensets
-@lru_cache(maxsize=100000)
-def compute_committees_memoized(abc_rule,m,k,resolute,ballots):
+# computes winning committees, native implementation for rules in NATIVE_RULES (see rules.py)
+# ballots: canonical (sorted) tuple of bitmasks
+# returns tuple of committee bitmasks, sorted lexicographically by their candidates
+def compute_committees(abc_rule,m,k,resolute,ballots):
+    if abc_rule in NATIVE_RULES:
+        return compute_rule(abc_rule,m,k,resolute,ballots)
     profile = Profile(num_cand=m)
-    profile.add_voters(ballots)
-    return hashable_sorted_set_list(abcrules.compute(abc_rule,profile,k,resolute=resolute))
+    profile.add_voters([candidates(A) for A in ballots])
+    return tuple(map(to_mask,sorted(map(sorted,abcrules.compute(abc_rule,profile,k,resolute=resolute)))))
+
+# computes lexicographically first winning committee and tie flag
+# optimisation: memoized per process (L1), shared between pool workers (L2, see shared_cache.py)
+# and optionally stored on disk across runs (L3, see persistent_cache.py)
+# profile: anonymous ProfileKey, canonical (sorted) ballots are only built on an L1 miss
+@lru_cache(maxsize=100000)
+def compute_committee_memoized(abc_rule,m,k,resolute,profile):
+    ballots = profile.canonical()
+    key = (abc_rule,m,k,resolute,ballots)
+    result = shared_cache.lookup(key)
+    if result is not None:
+        return result
+    result = persistent_cache.lookup(key)
+    if result is None:
+        if abc_rule == "thiele_manual":
+            result = compute_thiele(m,k,ballots)
+        else:
+            committees = compute_committees(abc_rule,m,k,resolute,ballots)
+            result = committees[0], len(committees) > 1
+        persistent_cache.store(key,result)
+    shared_cache.store(key,result)
+    return result
 
 # computes winning committee and checks if tied
-# makes parameters hashable for and unpacks tuples from memoized function
-# returns lexicographically first committee and bool whether committee is tied
+# takes ballots as bitmasks (list, BallotProfile or ProfileKey), anonymous key for memoized function
+# returns lexicographically first committee (bitmask) and bool whether committee is tied
 def compute_committee(params:Parameters, ballots):
-    ballots_hashable = hashable_sorted_set_list(ballots)
-    if params.abcvoting.abc_rule == "thiele_manual":
-        W, tied = compute_thiele(params.abcvoting.m,params.abcvoting.k,ballots_hashable)
-        if W is None:
-            return None, True
-        return set(W),tied
-    else:
-        committees = compute_committees_memoized(params.abcvoting.abc_rule,params.abcvoting.m,params.abcvoting.k,params.abcvoting.resolute,ballots_hashable)
-        committee = set(committees[0])
-        tied = len(committees) > 1
-        return committee,tied
-
+    shared_cache.local_counters["calls"] += 1
+    return compute_committee_memoized(params.abcvoting.abc_rule,params.abcvoting.m,params.abcvoting.k,params.abcvoting.resolute,profile_key(ballots))
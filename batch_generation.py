@@ -0,0 +1,260 @@
+# basics
+import sys
+import numpy as np
+
+# IABC
+from types_classes import Parameters
+from basics_and_helpers import configuration_key, sampling_seed
+from bitmasks import BallotProfile, candidates, to_mask
+
+"""
+Vectorized generation of the profiles of many elections at once (same cultures as prefsampling and ballot_generation.py)
+    - approval tensors: bool array (elections, voters, candidates), True if the voter approves the candidate
+    - rank tensors (ordinal): int array (elections, voters, ranks), candidate at each rank
+generators take a numpy Generator and the number of profiles, all randomness is drawn in a few array operations
+profiles are converted to bitmasks (see bitmasks.py) in one pass (packbits), workers draw profiles one at a time (draw_profile):
+    - seeded elections (ExecutionParams.seed): one profile from a generator seeded by the election's stream
+    - unseeded: profiles of a configuration are generated in batches and buffered per worker
+skip_empty_ballots: cultures sampling voters independently (impartial, resampling, candidate_interval) only resample the
+voters with an empty ballot (same distribution as rejecting the whole profile), all other cultures reject whole profiles,
+both for at most MAX_REJECTION_ROUNDS rounds, the number of ballots sampled per accepted profile is returned (acceptance statistics)
+"""
+
+# upper bounds for the size of a batch (profiles, entries of the approval tensor)
+MAX_BATCH_PROFILES = 256
+MAX_BATCH_ENTRIES = 2**22
+# upper bound for rounds of rejection sampling (skip_empty_ballots)
+MAX_REJECTION_ROUNDS = 10000
+# dichotomous cultures sampling the ballots of all voters independently and identically
+INDEPENDENT_CULTURES = ["impartial","resampling","candidate_interval"]
+
+
+# HELPER FUNCTIONS
+# normally distributed sizes rounded to integers (half to even, as round) and clipped to [a,b], see random_number_between
+def random_sizes(rng, a, b, mean, std, shape):
+    return np.clip(np.rint(rng.normal(mean,std,shape)),a,b).astype(np.int64)
+
+# intervals [start, start+size) of length size at uniformly random positions in range(length), as bool array (..., length)
+def random_intervals(rng, sizes, length):
+    starts = rng.integers(0,length-sizes+1)
+    positions = np.arange(length)
+    return (positions >= starts[...,None]) & (positions < (starts+sizes)[...,None])
+
+# urn scheme of prefsampling: voter i draws a new ballot with probability 1/(1+i*alpha), otherwise copies a previous voter
+# returns for every voter the voter whose new ballot it holds (copy chains resolved by pointer jumping)
+def urn_sources(rng, num_profiles, num_voters, alpha):
+    i = np.arange(num_voters)
+    new = rng.uniform(0,1+i*alpha,(num_profiles,num_voters)) <= 1.0
+    sources = np.where(new,i,np.floor(rng.random((num_profiles,num_voters))*i).astype(np.int64))
+    while True:
+        jumped = np.take_along_axis(sources,sources,axis=1)
+        if np.array_equal(jumped,sources):
+            return sources
+        sources = jumped
+
+# approval tensor to ballots as bitmasks (list of lists)
+def to_masks(approvals):
+    packed = np.packbits(approvals,axis=2,bitorder="little")
+    width = packed.shape[2]
+    return [[int.from_bytes(data[v*width:(v+1)*width],"little") for v in range(packed.shape[1])] for data in map(bytes,packed)]
+
+# ballots of the source voters (tensor indexed by profile and voter)
+def copy_sources(tensor, sources):
+    return tensor[np.arange(len(tensor))[:,None],sources]
+
+
+# DICHOTOMOUS CULTURES (approval tensors)
+# every candidate approved with probability p
+def impartial_batch(rng, num_profiles, num_voters, num_candidates, p):
+    return rng.random((num_profiles,num_voters,num_candidates)) <= p
+
+# central vote: first int(p*m) candidates, every candidate resampled with probability phi (approved with probability p)
+def resampling_batch(rng, num_profiles, num_voters, num_candidates, phi, p):
+    shape = (num_profiles,num_voters,num_candidates)
+    central = np.arange(num_candidates) < int(p*num_candidates)
+    resample = rng.random(shape) <= phi
+    return np.where(resample,rng.random(shape) <= p,central)
+
+# urn scheme with impartial ballots
+def urn_batch(rng, num_profiles, num_voters, num_candidates, p, alpha):
+    sources = urn_sources(rng,num_profiles,num_voters,alpha)
+    return copy_sources(impartial_batch(rng,num_profiles,num_voters,num_candidates,p),sources)
+
+# every voter approves an interval of candidates of average size avg_size
+def candidate_interval_batch(rng, num_profiles, num_voters, num_candidates, avg_size, skip_empty_ballots):
+    sizes = random_sizes(rng,skip_empty_ballots,num_candidates,avg_size,num_candidates/8,(num_profiles,num_voters))
+    return random_intervals(rng,sizes,num_candidates)
+
+# every candidate is approved by an interval of voters, average ballot size avg_size
+# empty ballots are replaced by a random singleton if skip_empty_ballots
+def voter_interval_batch(rng, num_profiles, num_voters, num_candidates, avg_size, skip_empty_ballots):
+    avg_size_support_set = (avg_size * num_voters)/num_candidates
+    sizes = random_sizes(rng,0,num_voters,avg_size_support_set,num_voters/8,(num_profiles,num_candidates))
+    # support sets (profiles, candidates, voters) to ballots (profiles, voters, candidates)
+    approvals = random_intervals(rng,sizes,num_voters).transpose(0,2,1).copy()
+    if skip_empty_ballots:
+        empty = np.nonzero(~approvals.any(axis=2))
+        approvals[empty + (rng.integers(0,num_candidates,len(empty[0])),)] = True
+    return approvals
+
+
+# ORDINAL CULTURES (rank tensors)
+# uniformly random rankings
+def impartial_ordinal_batch(rng, num_profiles, num_voters, num_candidates):
+    return rng.random((num_profiles,num_voters,num_candidates)).argsort(axis=2)
+
+# urn scheme with uniformly random rankings
+def urn_ordinal_batch(rng, num_profiles, num_voters, num_candidates, alpha):
+    sources = urn_sources(rng,num_profiles,num_voters,alpha)
+    return copy_sources(impartial_ordinal_batch(rng,num_profiles,num_voters,num_candidates),sources)
+
+# approve the first sizes[e,v] candidates of every ranking
+def cutoff_batch(preferences, sizes):
+    approvals = np.zeros(preferences.shape,dtype=bool)
+    np.put_along_axis(approvals,preferences,np.arange(preferences.shape[2]) < sizes[...,None],axis=2)
+    return approvals
+
+# random cutoff of average size avg_size (see cutoff_from_ordinal_r)
+def random_cutoff_batch(rng, preferences, avg_size, skip_empty_ballots):
+    num_candidates = preferences.shape[2]
+    return cutoff_batch(preferences,random_sizes(rng,skip_empty_ballots,num_candidates,avg_size,num_candidates/8,preferences.shape[:2]))
+
+
+# GENERAL BATCH GENERATION
+# generate num_profiles profiles from given parameters (culture not manual), num_voters overrides n
+# returns rank tensor (None if dichotomous) and approval tensor
+def generate_profiles(params:Parameters, rng, num_profiles, num_voters=None):
+    g, n, m, k = params.ballot_generation, num_voters or params.abcvoting.n, params.abcvoting.m, params.abcvoting.k
+    if g.ordinal:
+        match g.culture:
+            case "impartial":
+                preferences = impartial_ordinal_batch(rng,num_profiles,n,m)
+            case "urn":
+                preferences = urn_ordinal_batch(rng,num_profiles,n,m,g.alpha)
+            case _:
+                print("\033[91mCulture not supported for batch generation: " + str(g.culture) + "\033[0m")
+                raise ValueError
+        if g.random_cutoff:
+            approvals = random_cutoff_batch(rng,preferences,k*g.avg_ballot_size,g.skip_empty_ballots)
+        else:
+            approvals = cutoff_batch(preferences,np.broadcast_to(np.array(g.cutoff_points),preferences.shape[:2]))
+        return preferences, approvals
+    # set candidate approval probability p to k/m * avg_ballot_size
+    p = k/m * g.avg_ballot_size
+    match g.culture:
+        case "impartial":
+            approvals = impartial_batch(rng,num_profiles,n,m,p)
+        case "resampling":
+            approvals = resampling_batch(rng,num_profiles,n,m,g.phi,p)
+        case "urn":
+            approvals = urn_batch(rng,num_profiles,n,m,p,g.alpha)
+        case "candidate_interval":
+            approvals = candidate_interval_batch(rng,num_profiles,n,m,k*g.avg_ballot_size,g.skip_empty_ballots)
+        case "voter_interval":
+            approvals = voter_interval_batch(rng,num_profiles,n,m,k*g.avg_ballot_size,g.skip_empty_ballots)
+        case _:
+            print("\033[91mCulture not supported for batch generation: " + str(g.culture) + "\033[0m")
+            raise ValueError
+    return None, approvals
+
+def rejection_error(params:Parameters):
+    print("\033[91mNo profile without empty ballots after " + str(MAX_REJECTION_ROUNDS) + " rounds of rejection sampling (culture " + str(params.ballot_generation.culture) + "), increase avg_ballot_size or disable skip_empty_ballots\033[0m")
+    raise ValueError
+
+# resample the empty ballots of independently sampled voters until no ballot is empty
+# returns approvals and number of ballots sampled per profile
+def resample_empty_ballots(params:Parameters, rng, approvals):
+    sampled = np.full(len(approvals),approvals.shape[1])
+    for _ in range(MAX_REJECTION_ROUNDS):
+        empty = np.nonzero(~approvals.any(axis=2))
+        if len(empty[0]) == 0:
+            return approvals, sampled
+        approvals[empty] = generate_profiles(params,rng,1,len(empty[0]))[1][0]
+        np.add.at(sampled,empty[0],1)
+    rejection_error(params)
+
+# reject whole profiles with an empty ballot until at least one profile is accepted
+# returns preferences and approvals of the accepted profiles and number of ballots sampled per accepted profile
+# (ballots of rejected profiles are distributed over the accepted profiles)
+def reject_empty_profiles(params:Parameters, rng, num_profiles):
+    for rounds in range(1,MAX_REJECTION_ROUNDS+1):
+        preferences, approvals = generate_profiles(params,rng,num_profiles)
+        accepted = np.flatnonzero(approvals.any(axis=2).all(axis=1))
+        if len(accepted) > 0:
+            break
+    else:
+        rejection_error(params)
+    total = rounds * num_profiles * approvals.shape[1]
+    sampled = total // len(accepted) + (np.arange(len(accepted)) < total % len(accepted))
+    return None if preferences is None else preferences[accepted], approvals[accepted], sampled
+
+# profiles of a batch as (preferences_truthful, profile_truthful, ballots_sampled) in the format of generate_ballots
+# at least one profile is returned (all num_profiles unless whole profiles are rejected)
+def sample_profiles(params:Parameters, rng, num_profiles):
+    g = params.ballot_generation
+    if not g.skip_empty_ballots:
+        preferences, approvals = generate_profiles(params,rng,num_profiles)
+        sampled = np.full(num_profiles,approvals.shape[1])
+    elif not g.ordinal and g.culture in INDEPENDENT_CULTURES:
+        preferences, (approvals, sampled) = None, resample_empty_ballots(params,rng,generate_profiles(params,rng,num_profiles)[1])
+    else:
+        preferences, approvals, sampled = reject_empty_profiles(params,rng,num_profiles)
+    m = params.abcvoting.m
+    return [(None if preferences is None else preferences[e].tolist(), BallotProfile(masks,m), int(sampled[e])) for e, masks in enumerate(to_masks(approvals))]
+
+def batch_size(num_voters, num_candidates):
+    return max(1,min(MAX_BATCH_PROFILES,MAX_BATCH_ENTRIES // (num_voters*num_candidates)))
+
+
+# WORKER SIDE
+# generator of the worker (created in the worker, independent streams after fork) and buffered profiles of one configuration
+# (sweep tasks are ordered by configuration: leftover profiles of the previous configuration are dropped when the key changes)
+generator = None
+buffer_key = None
+buffer = []
+
+# next profile for the given parameters (culture not manual)
+def draw_profile(params:Parameters):
+    global generator, buffer_key, buffer
+    seed = sampling_seed()
+    if seed is not None:
+        return sample_profiles(params,np.random.default_rng(seed),1)[0]
+    if generator is None:
+        generator = np.random.default_rng()
+    key = configuration_key(params)
+    if key != buffer_key:
+        buffer_key, buffer = key, []
+    if buffer == []:
+        buffer = sample_profiles(params,generator,batch_size(params.abcvoting.n,params.abcvoting.m))
+    return buffer.pop()
+
+
+# VERIFICATION
+# approval frequency of every (voter, candidate) and frequency of equal ballots of voters 0 and 1 in a list of profiles
+def profile_frequencies(profiles, n, m):
+    counts = np.zeros((n,m))
+    for _, ballots, _ in profiles:
+        for v, mask in enumerate(ballots):
+            counts[v,candidates(mask)] += 1
+    return counts / len(profiles), np.mean([ballots[0] == ballots[1] for _, ballots, _ in profiles])
+
+# compare frequencies of batch generation to the reference generators (prefsampling, ballot_generation.py)
+# returns list of (culture, ordinal, largest difference of frequencies), differences are sampling noise (about 1/sqrt(num_profiles))
+def check_batch_generation(num_profiles=5000, n=6, m=8, k=3, seed=0):
+    from ballot_generation import reference_ballots
+    from parameters import set_params
+    rng = np.random.default_rng(seed)
+    result = []
+    for culture, ordinal in [("impartial",False),("resampling",False),("urn",False),("candidate_interval",False),("voter_interval",False),("impartial",True),("urn",True)]:
+        params = set_params(num_profiles,True,ordinal,culture,1,0.3,0.5,[],[],True,[],"av",n,m,k,False,1,True,"cutoff" if ordinal else "subset",1,"PD" if ordinal else "AV",False,False,"")
+        batch = []
+        while len(batch) < num_profiles:
+            batch += [(preferences, profile.masks, sampled) for preferences, profile, sampled in sample_profiles(params,rng,num_profiles-len(batch))]
+        reference = [(preferences, [to_mask(A_v) for A_v in ballots], None) for preferences, ballots in (reference_ballots(params) for _ in range(num_profiles))]
+        (approvals_batch, equal_batch), (approvals_reference, equal_reference) = profile_frequencies(batch,n,m), profile_frequencies(reference,n,m)
+        result.append((culture,ordinal,max(np.abs(approvals_batch-approvals_reference).max(),abs(equal_batch-equal_reference))))
+    return result
+
+if __name__ == "__main__":
+    for culture, ordinal, difference in check_batch_generation(int(sys.argv[1]) if len(sys.argv) > 1 else 5000):
+        print(culture + (" (ordinal)" if ordinal else "") + ": " + str(round(difference,4)))
@@ -0,0 +1,325 @@
+# basics
+import numpy as np
+from itertools import combinations
+from functools import lru_cache
+import struct
+
+"""
+Bitmask representation of ballots and profiles
+a ballot (set of candidates) is stored as an int with bit c set iff candidate c is approved
+    - utilities become popcounts, e.g. |A_i ∩ W| = popcount(A_i & W)
+    - flipping candidates (swap_j) becomes XOR
+    - profiles are tuples of ints: hashable, cheap to copy, sort and pickle
+    - anonymous profiles (cache keys) are multisets of ballot types with a running hash,
+      replacing the ballot of one voter updates the key in O(1)
+    - profiles have a positional (Zobrist-style) fingerprint for cycle detection, also updated in O(1)
+    - trajectories of deviations are the truthful profile and (voter, ballot, committee) deltas,
+      intermediate profiles are reconstructed on demand
+"""
+
+MASK_64 = (1 << 64) - 1
+
+# CONVERSION
+# convert set of candidates to bitmask
+def to_mask(ballot) -> int:
+    mask = 0
+    for c in ballot:
+        mask |= 1 << int(c)
+    return mask
+
+# list of candidates in bitmask (ascending)
+def candidates(mask:int) -> list[int]:
+    result = []
+    while mask:
+        low = mask & -mask
+        result.append(low.bit_length()-1)
+        mask ^= low
+    return result
+
+# convert bitmask to set of candidates
+def from_mask(mask:int) -> set[int]:
+    return set(candidates(mask))
+
+# number of candidates in bitmask
+def popcount(mask:int) -> int:
+    return mask.bit_count()
+
+
+# BALLOT GENERATION
+# all non-empty subsets of a ballot
+def submasks(mask:int) -> list[int]:
+    result = []
+    sub = mask
+    while sub:
+        result.append(sub)
+        sub = (sub - 1) & mask
+    return result
+
+# all non-empty ballots over m candidates
+def all_masks(m:int) -> list[int]:
+    return list(range(1,1 << m))
+
+# all prefixes of an ordinal preference (cutoff ballots)
+def prefix_masks(preference) -> list[int]:
+    result, mask = [], 0
+    for c in preference:
+        mask |= 1 << int(c)
+        result.append(mask)
+    return result
+
+# all committees of size k in lexicographic order of their sorted candidate tuples
+def committee_masks(m:int, k:int) -> list[int]:
+    return [to_mask(W) for W in combinations(range(m),k)]
+
+
+# n x m boolean approval matrix of a list of ballot bitmasks
+def approval_matrix(ballots, m:int):
+    if m <= 64:
+        masks = np.array(ballots,dtype=np.uint64).reshape(-1,1)
+        return ((masks >> np.arange(m,dtype=np.uint64)) & np.uint64(1)).astype(bool)
+    return np.array([[(A >> c) & 1 for c in range(m)] for A in ballots],dtype=bool).reshape(-1,m)
+
+
+# ANONYMOUS PROFILE KEYS
+# pseudo-random 64-bit hash of a ballot type (splitmix64 finalizer over 64-bit chunks of the bitmask)
+@lru_cache(maxsize=2**16)
+def type_hash(mask:int) -> int:
+    h = 0x9E3779B97F4A7C15
+    while True:
+        h = (h ^ (mask & MASK_64)) * 0xBF58476D1CE4E5B9 & MASK_64
+        h = (h ^ (h >> 27)) * 0x94D049BB133111EB & MASK_64
+        h ^= h >> 31
+        mask >>= 64
+        if not mask:
+            return h
+
+# anonymous profile: multiset of ballot types (ballot -> count)
+# hash is the sum of the type hashes of all ballots (mod 2^64) and is updated with every replaced ballot
+# a key derived by replace only stores its parent and the delta, the counts are built when they are needed
+# (equality check on a cache hit, canonical ballots on a cache miss)
+class ProfileKey:
+    __slots__ = ("counts_cache", "parent", "removed", "added", "hash_value")
+
+    def __init__(self, counts, hash_value:int, parent=None, removed=None, added=None):
+        self.counts_cache = counts
+        self.hash_value = hash_value
+        self.parent, self.removed, self.added = parent, removed, added
+
+    @classmethod
+    def from_ballots(cls, ballots):
+        counts, hash_value = {}, 0
+        for ballot in ballots:
+            counts[ballot] = counts.get(ballot,0) + 1
+            hash_value += type_hash(ballot)
+        return cls(counts,hash_value & MASK_64)
+
+    # key of the profile with one ballot old replaced by new
+    def replace(self, old:int, new:int):
+        if old == new:
+            return self
+        # keep chains of derived keys at length one
+        if self.parent is not None:
+            self.counts()
+        return ProfileKey(None,(self.hash_value - type_hash(old) + type_hash(new)) & MASK_64,self,old,new)
+
+    # key of the profile without one ballot old (e.g. the other voters of a voter with ballot old)
+    def remove(self, old:int):
+        if self.parent is not None:
+            self.counts()
+        return ProfileKey(None,(self.hash_value - type_hash(old)) & MASK_64,self,old,None)
+
+    # ballot types and their counts
+    def counts(self) -> dict[int,int]:
+        if self.counts_cache is None:
+            counts = dict(self.parent.counts())
+            if counts[self.removed] == 1:
+                del counts[self.removed]
+            else:
+                counts[self.removed] -= 1
+            if self.added is not None:
+                counts[self.added] = counts.get(self.added,0) + 1
+            self.counts_cache, self.parent = counts, None
+        return self.counts_cache
+
+    # sorted tuple of bitmasks
+    def canonical(self) -> tuple[int]:
+        return tuple(ballot for ballot, count in sorted(self.counts().items()) for _ in range(count))
+
+    def __hash__(self):
+        return self.hash_value
+
+    def __eq__(self, other):
+        if not isinstance(other, ProfileKey):
+            return NotImplemented
+        return self is other or (self.hash_value == other.hash_value and self.counts() == other.counts())
+
+    def __reduce__(self):
+        return (ProfileKey, (self.counts(), self.hash_value))
+
+# PROFILE FINGERPRINTS
+# pseudo-random 64-bit hash of the ballot of voter i (Zobrist key of the pair (i, ballot))
+def ballot_hash(i:int, mask:int) -> int:
+    h = (type_hash(mask) ^ (i * 0x9E3779B97F4A7C15)) * 0xBF58476D1CE4E5B9 & MASK_64
+    h = (h ^ (h >> 27)) * 0x94D049BB133111EB & MASK_64
+    return h ^ (h >> 31)
+
+# fingerprint of a (non-anonymous) profile: sum of the ballot hashes of all voters (mod 2^64)
+def fingerprint(ballots) -> int:
+    return sum(ballot_hash(i,ballot) for i, ballot in enumerate(ballots)) & MASK_64
+
+# anonymous key of a profile (list of bitmasks, BallotProfile or ProfileKey)
+def profile_key(ballots) -> ProfileKey:
+    if isinstance(ballots, ProfileKey):
+        return ballots
+    if isinstance(ballots, BallotProfile):
+        return ballots.key()
+    return ProfileKey.from_ballots(ballots)
+
+
+# PROFILES
+# immutable profile of ballot bitmasks, replacing a ballot returns a new profile
+class BallotProfile:
+    __slots__ = ("masks", "m", "key_cache", "fingerprint_cache")
+
+    def __init__(self, masks, m:int, key_cache=None, fingerprint_cache=None):
+        self.masks = tuple(masks)
+        self.m = m
+        self.key_cache = key_cache
+        self.fingerprint_cache = fingerprint_cache
+
+    # create profile from list of sets
+    @classmethod
+    def from_ballots(cls, ballots, m:int):
+        return cls(map(to_mask,ballots),m)
+
+    # list of sets, used for output and property checks
+    def to_sets(self) -> list[set[int]]:
+        return [from_mask(mask) for mask in self.masks]
+
+    # anonymous profile: sorted tuple of bitmasks
+    def canonical(self) -> tuple[int]:
+        return tuple(sorted(self.masks))
+
+    # anonymous key of the profile (computed once, updated by with_ballot)
+    def key(self) -> ProfileKey:
+        if self.key_cache is None:
+            self.key_cache = ProfileKey.from_ballots(self.masks)
+        return self.key_cache
+
+    # fingerprint of the profile (computed once, updated by with_ballot)
+    def fingerprint(self) -> int:
+        if self.fingerprint_cache is None:
+            self.fingerprint_cache = fingerprint(self.masks)
+        return self.fingerprint_cache
+
+    # profile with ballot of voter i replaced
+    def with_ballot(self, i:int, mask:int):
+        key = None if self.key_cache is None else self.key_cache.replace(self.masks[i],mask)
+        fingerprint_new = None if self.fingerprint_cache is None else (self.fingerprint_cache - ballot_hash(i,self.masks[i]) + ballot_hash(i,mask)) & MASK_64
+        return BallotProfile(self.masks[:i] + (mask,) + self.masks[i+1:],self.m,key,fingerprint_new)
+
+    # profile is immutable, copies share the ballot tuple
+    def copy(self):
+        return self
+
+    # NumPy view of profile (one uint64 per voter), only for m <= 64
+    def as_array(self):
+        if self.m > 64:
+            raise ValueError("uint64 profile array requires m <= 64")
+        return np.array(self.masks,dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __getitem__(self, i):
+        return self.masks[i]
+
+    def __iter__(self):
+        return iter(self.masks)
+
+    def __hash__(self):
+        return hash(self.masks)
+
+    def __eq__(self, other):
+        if not isinstance(other, BallotProfile):
+            return NotImplemented
+        return self.masks == other.masks
+
+    def __reduce__(self):
+        return (BallotProfile, (self.masks, self.m))
+
+    def __str__(self):
+        return str(self.to_sets())
+
+    __repr__ = __str__
+
+
+# TRAJECTORIES
+# deviations of an iteration: truthful profile and one delta (voter, new ballot, new committee) per deviation
+# entries are read as (voter, profile after the deviation, committee as set), profiles are rebuilt on demand
+# pickled as compact bytes (encode), e.g. when election data is returned from pool workers
+class Trajectory:
+    __slots__ = ("truthful", "voters", "ballots", "committees")
+
+    def __init__(self, truthful:BallotProfile, voters=None, ballots=None, committees=None):
+        self.truthful = truthful
+        self.voters = [] if voters is None else voters
+        self.ballots = [] if ballots is None else ballots
+        self.committees = [] if committees is None else committees
+
+    # voter changes its ballot, new committee as bitmask
+    def append(self, voter:int, ballot:int, committee:int):
+        self.voters.append(voter)
+        self.ballots.append(ballot)
+        self.committees.append(committee)
+
+    # profile after the first d deviations (O(n + d))
+    def profile(self, d:int) -> BallotProfile:
+        if d == 0:
+            return self.truthful
+        masks = list(self.truthful.masks)
+        for voter, ballot in zip(self.voters[:d],self.ballots[:d]):
+            masks[voter] = ballot
+        return BallotProfile(masks,self.truthful.m)
+
+    # bytes: header (n, m, number of deviations), voters (uint32), truthful ballots, new ballots and committees
+    # (bitmasks in little-endian bytes of fixed width)
+    def encode(self) -> bytes:
+        n, m, width = len(self.truthful), self.truthful.m, (self.truthful.m + 7) // 8
+        masks = self.truthful.masks + tuple(self.ballots) + tuple(self.committees)
+        return struct.pack("<III",n,m,len(self.voters)) + np.array(self.voters,dtype="<u4").tobytes() + b"".join(mask.to_bytes(width,"little") for mask in masks)
+
+    @classmethod
+    def decode(cls, data:bytes):
+        n, m, d = struct.unpack_from("<III",data)
+        width, offset = (m + 7) // 8, struct.calcsize("<III") + 4*d
+        voters = np.frombuffer(data,dtype="<u4",count=d,offset=struct.calcsize("<III")).tolist()
+        masks = [int.from_bytes(data[offset + j*width:offset + (j+1)*width],"little") for j in range(n + 2*d)]
+        return cls(BallotProfile(masks[:n],m),voters,masks[n:n+d],masks[n+d:])
+
+    def __len__(self):
+        return len(self.voters)
+
+    def __getitem__(self, d):
+        d = range(len(self))[d]
+        return self.voters[d], self.profile(d+1), from_mask(self.committees[d])
+
+    # profiles are rebuilt incrementally (O(n) per deviation)
+    def __iter__(self):
+        profile = self.truthful
+        for voter, ballot, committee in zip(self.voters,self.ballots,self.committees):
+            profile = profile.with_ballot(voter,ballot)
+            yield voter, profile, from_mask(committee)
+
+    def __eq__(self, other):
+        if not isinstance(other, Trajectory):
+            return NotImplemented
+        return (self.truthful, self.voters, self.ballots, self.committees) == (other.truthful, other.voters, other.ballots, other.committees)
+
+    def __reduce__(self):
+        return (Trajectory.decode, (self.encode(),))
+
+    def __str__(self):
+        return str(list(self))
+
+    __repr__ = __str__
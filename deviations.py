@@ -1,71 +1,149 @@
 # basics
 from types_classes import *
 from itertools import combinations
+from collections import OrderedDict
 import random
 
 # IABC
-from ballot_generation import all_cutoffs_from_ordinal
-from basics_and_helpers import compute_committee, powerset
-from set_preferences import cmp_committees, U_AV, U_CCAV
+from bitmasks import all_masks, prefix_masks, profile_key, submasks, to_mask
+from incremental import IncrementalEvaluator
+from oracles import best_response_ballots
+from set_preferences import ProfileRanks, cmp_committees, cmp_committees_batch, is_unbeatable
 
 
 # DEVIATIONS
 # all ballots obtained by swap-j heuristic (iterative up to j, adapted from Martinez)
+# ballot as bitmask, flipping candidates is XOR with the bitmask of flipped candidates
 def get_ballots_swap_j(ballot, j, m):
     ballots_result = []
     for i in range(1,j+1):
         flip_tuples = combinations(range(m), i)
         for flip_candidates in flip_tuples:
-            new_ballot = ballot.copy()
-            for c in flip_candidates:
-                if c in new_ballot:
-                    new_ballot.remove(c)
-                else:
-                    new_ballot.add(c)
-            ballots_result.append(new_ballot)
+            ballots_result.append(ballot ^ to_mask(flip_candidates))
     return ballots_result
 
-# generate all possible deviating ballots
+# all possible deviating ballots (bitmasks) in a fixed order
 # takes parameters, a voter's truthful preference/ballot and the current ballot
-def get_deviation_ballots(params:Parameters,preferences_t,ballots_t,ballots,i):
+# optimisation: restricted to ballots of a best-response oracle if available (see oracles.py)
+def deviation_space(params:Parameters,preferences_t,ballots_t,ballots,i):
+    deviation_ballots = best_response_ballots(params,ballots_t,i)
+    if deviation_ballots is not None:
+        return deviation_ballots
     match params.deviation.deviation_type:
         case "cutoff":
-            deviation_ballots = all_cutoffs_from_ordinal(preferences_t[i])
+            return prefix_masks(preferences_t[i])
         case "subset":
-            deviation_ballots = powerset(ballots_t[i])
+            return submasks(ballots_t[i])
         case "brute_force":
-            deviation_ballots = powerset(range(params.abcvoting.m))
+            return all_masks(params.abcvoting.m)
         case "swap_j":
-            deviation_ballots = get_ballots_swap_j(ballots[i],params.deviation.swap_j,params.abcvoting.m)
+            return get_ballots_swap_j(ballots[i],params.deviation.swap_j,params.abcvoting.m)
         case _:
             print("\033[91mUnknown deviation type: " + str(params.deviation.deviation_type) + "\033[0m")
             raise ValueError
+
+# generate all possible deviating ballots (bitmasks) in random order
+def get_deviation_ballots(params:Parameters,preferences_t,ballots_t,ballots,i):
+    deviation_ballots = deviation_space(params,preferences_t,ballots_t,ballots,i)
     # shuffle deviation ballots to avoid bias
     random.shuffle(deviation_ballots)
     return deviation_ballots
             
+# RESPONSE TABLES
+# committees and tie flags of the test ballots of a voter (ballot -> (W, tied)), filled while ballots are evaluated
+# rules are anonymous: the committee only depends on the test ballot and the multiset of the other ballots,
+# a table is shared by all voters and elections facing the same other ballots (repeated profiles, cycles)
+# per process, least recently used tables are removed first (at most ExecutionParams.response_cache_entries committees)
+response_tables  = OrderedDict()
+response_entries = 0
+
+# table of the rule for the other ballots (anonymous ProfileKey), not stored if the cache is disabled
+def response_table(params:Parameters, others):
+    if params.execution.response_cache_entries == 0:
+        return {}
+    key = (params.abcvoting.abc_rule,params.abcvoting.m,params.abcvoting.k,params.abcvoting.resolute,others)
+    table = response_tables.get(key)
+    if table is None:
+        # stored keys keep their own counts, not the profile key they were derived from
+        others.counts()
+        table = response_tables[key] = {}
+    else:
+        response_tables.move_to_end(key)
+    return table
+
+# add evaluated test ballots to a table, keep the total number of committees below response_cache_entries
+def store_responses(params:Parameters, table, ballots, committees):
+    global response_entries
+    size = len(table)
+    table.update(zip(ballots,committees))
+    if params.execution.response_cache_entries == 0:
+        return
+    response_entries += len(table) - size
+    while response_entries > params.execution.response_cache_entries and len(response_tables) > 1:
+        _, oldest = response_tables.popitem(last=False)
+        response_entries -= len(oldest)
+
 # find a best deviation for voter i according to deviation type and comparison function
-def get_deviation(params:Parameters, preferences_t, ballots_t, i, ballots, W_current):
+# ballots and committees as bitmasks, ranks_t: ProfileRanks of the truthful preferences (ordinal, computed if not given)
+def get_deviation(params:Parameters, preferences_t, ballots_t, i, ballots, W_current, ranks_t=None):
+    if ranks_t is None and params.ballot_generation.ordinal:
+        ranks_t = ProfileRanks(preferences_t)
     ballot_old = ballots[i]
     # generate all possible deviating ballots in random order according to deviation type
     deviation_ballots = get_deviation_ballots(params,preferences_t,ballots_t,ballots,i)
     # initialise: current best ballot and committee W
     ballot_best,W_best = ballot_old, W_current
-    for ballot_test in deviation_ballots:
-        # optimisation: if utility is already maximal, no need to continue
-        if (params.deviation.set_preference == "AV" and U_AV(W_best,ballots_t[i]) == min(params.abcvoting.k,len(ballots_t[i]))) or (params.deviation.set_preference == "CCAV" and U_CCAV(W_best,ballots_t[i]) == 1) or (params.ballot_generation.ordinal and W_best == set(preferences_t[i][:params.abcvoting.k])):
+    # optimisation: stop as soon as no committee is strictly preferred to W_best
+    unbeatable = W_best is not None and is_unbeatable(params,ranks_t,ballots_t,i,W_best)
+    # optimisation: only ballot of voter i changes, evaluate test ballots incrementally
+    evaluator = IncrementalEvaluator(params,ballots,i)
+    # optimisation: reuse committees of test ballots evaluated before against the same other ballots
+    # ballots are still enumerated and shuffled and the search below is unchanged (same random streams and results)
+    table = response_table(params,profile_key(ballots).remove(ballot_old))
+    # optimisation: evaluate test ballots in batches (vectorized where supported), in order to keep early termination
+    for start in range(0,len(deviation_ballots),evaluator.batch_size):
+        if unbeatable:
             break
-        # copy ballots and insert current swap ballot to check new W
-        ballots[i] = ballot_test
-        # compute committee with test ballot, check if tied
-        W_test,tied = compute_committee(params,ballots)
-        if params.deviation.skip_ties and tied:
-            continue
-        # update current best deviation if W_test is better than W_best
-        if cmp_committees(params,preferences_t,ballots_t,i,W_test,W_best):
-            ballot_best,W_best = ballot_test,W_test
+        batch = deviation_ballots[start:start+evaluator.batch_size]
+        # compute committees with test ballots inserted for voter i, check if tied
+        missing = [ballot_test for ballot_test in batch if ballot_test not in table]
+        if missing:
+            store_responses(params,table,missing,evaluator.evaluate_batch(missing))
+        committees = [table[ballot_test] for ballot_test in batch]
+        # optimisation: compare all committees of a batch to W_best at once, set preferences are transitive:
+        # a committee better than an improved W_best is also better than W_best at the start of the batch
+        W_start = W_best
+        better = cmp_committees_batch(params,ranks_t,ballots_t,i,[W_test for W_test, _ in committees],W_best) if len(batch) > 1 else [True]*len(batch)
+        for ballot_test,(W_test,tied),is_better in zip(batch,committees,better):
+            if unbeatable:
+                break
+            if not is_better or (params.deviation.skip_ties and tied):
+                continue
+            # update current best deviation if W_test is better than W_best
+            if (len(batch) > 1 and W_best == W_start) or cmp_committees(params,ranks_t,ballots_t,i,W_test,W_best):
+                ballot_best,W_best = ballot_test,W_test
+                unbeatable = is_unbeatable(params,ranks_t,ballots_t,i,W_best)
     if ballot_best == ballot_old:
         return None
     return ballot_best,W_best
 
-
+# all ballots get_deviation can return for voter i (over all orders of the deviating ballots), empty if there is none
+# get_deviation returns the ballot b iff its committee W_b is strictly preferred to W_current
+# and no committee of another (not skipped) deviating ballot is strictly preferred to W_b
+# (set preferences are transitive: b is returned if it comes first, a better ballot would replace it in any order)
+def best_responses(params:Parameters, preferences_t, ballots_t, i, ballots, W_current, ranks_t=None):
+    if ranks_t is None and params.ballot_generation.ordinal:
+        ranks_t = ProfileRanks(preferences_t)
+    deviation_ballots = deviation_space(params,preferences_t,ballots_t,ballots,i)
+    table = response_table(params,profile_key(ballots).remove(ballots[i]))
+    missing = [ballot_test for ballot_test in deviation_ballots if ballot_test not in table]
+    if missing:
+        store_responses(params,table,missing,IncrementalEvaluator(params,ballots,i).evaluate_batch(missing))
+    responses = [(ballot_test,table[ballot_test][0]) for ballot_test in deviation_ballots if not (params.deviation.skip_ties and table[ballot_test][1])]
+    if not responses:
+        return []
+    better = cmp_committees_batch(params,ranks_t,ballots_t,i,[W_test for _, W_test in responses],W_current)
+    responses = [(ballot_test,W_test) for (ballot_test,W_test), is_better in zip(responses,better) if is_better]
+    committees = list({W_test for _, W_test in responses})
+    maximal = {W_test for W_test in committees if not any(cmp_committees_batch(params,ranks_t,ballots_t,i,committees,W_test))}
+    return [ballot_test for ballot_test, W_test in responses if W_test in maximal]
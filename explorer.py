@@ -0,0 +1,311 @@
+# basics
+import os, random, sqlite3, sys, tempfile
+from contextlib import nullcontext
+
+# IABC
+from types_classes import *
+from basics_and_helpers import compute_committee, configuration_key, seed_election
+from bitmasks import BallotProfile, from_mask, prefix_masks, to_mask
+from deviations import best_responses, get_deviation
+from iterations import generate_election, iterate_deviations, run_profiles
+from set_preferences import ProfileRanks
+
+# parallelisation
+from multiprocessing import Pool
+
+"""
+Exhaustive exploration of the deviation dynamics of a truthful profile (analysis mode, instead of sampling voter orders)
+state graph: profiles reachable from the truthful profile, an edge replaces the ballot of one voter by a ballot
+get_deviation can return (best_responses in deviations.py), every run of iterate_deviations follows a path of this graph
+    - sinks are equilibria, iterate_deviations converges there
+      (swap_j: iterate_deviations does not test the last deviating voter again, its swaps of the new ballot can
+      still improve, so it can also stop at profiles that are not sinks)
+    - strongly connected components with more than one profile are cycles (Tarjan),
+      iterate_deviations can cycle for some voter order iff such a component is reachable
+    - a closed component (no deviation leaves it) can never be left, an equilibrium is reachable from every
+      profile iff there is no closed component
+breadth-first search, the profiles of a level are expanded in parallel (pool workers compute the deviations)
+profiles are stored as fixed-width bytes of their ballots, the visited set is moved to an SQLite file once it
+exceeds max_memory_states (successor lists of the expanded profiles stay in memory)
+exploration stops after max_states expanded profiles (complete=False, results only cover the explored part)
+"""
+
+# upper bounds for expanded profiles and profiles of the visited set kept in memory
+MAX_STATES = 10**6
+MAX_MEMORY_STATES = 10**6
+# profiles expanded per pool task
+CHUNKSIZE = 16
+
+
+# STATES
+# profile as bytes: ballots as bitmasks in little-endian bytes of fixed width
+def encode_state(ballots, m:int) -> bytes:
+    width = (m + 7) // 8
+    return b"".join(ballot.to_bytes(width,"little") for ballot in ballots)
+
+def decode_state(state:bytes, m:int) -> BallotProfile:
+    width = (m + 7) // 8
+    return BallotProfile([int.from_bytes(state[j:j+width],"little") for j in range(0,len(state),width)],m)
+
+# visited profiles, numbered in the order they are added
+# kept in a dictionary, moved to an SQLite file (path, temporary file if None) when it exceeds max_memory_states
+class VisitedStates:
+    def __init__(self, max_memory_states=MAX_MEMORY_STATES, path=None):
+        self.memory = {}
+        self.size = 0
+        self.max_memory_states = max_memory_states
+        self.path, self.temporary, self.connection = path, path is None, None
+
+    # ids of the given profiles and whether they were added
+    def add(self, states):
+        ids, added = [], []
+        for state in states:
+            state_id = self.memory.get(state)
+            if state_id is None and self.connection is not None:
+                row = self.connection.execute("SELECT id FROM states WHERE state = ?",(state,)).fetchone()
+                state_id = None if row is None else row[0]
+            added.append(state_id is None)
+            if state_id is None:
+                state_id = self.memory[state] = self.size
+                self.size += 1
+            ids.append(state_id)
+        if len(self.memory) > self.max_memory_states:
+            self.spill()
+        return ids, added
+
+    # move profiles in memory to the SQLite file
+    def spill(self):
+        if self.connection is None:
+            if self.path is None:
+                fd, self.path = tempfile.mkstemp(suffix=".sqlite")
+                os.close(fd)
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute("PRAGMA journal_mode=OFF")
+            self.connection.execute("PRAGMA synchronous=OFF")
+            self.connection.execute("DROP TABLE IF EXISTS states")
+            self.connection.execute("CREATE TABLE states (state BLOB PRIMARY KEY, id INTEGER) WITHOUT ROWID")
+        with self.connection:
+            self.connection.executemany("INSERT INTO states VALUES (?,?)",self.memory.items())
+        self.memory.clear()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            if self.temporary:
+                os.remove(self.path)
+
+    def __len__(self):
+        return self.size
+
+
+# EXPANSION
+# parameters of the explored configuration (set in pool workers by init_explorer)
+explorer_parameters = None
+
+def init_explorer(params:Parameters):
+    global explorer_parameters
+    explorer_parameters = params
+
+# task: truthful preferences and ballots, list of profiles (bytes)
+# returns committee (bitmask) and successor profiles of every profile
+def expand_states(task):
+    preferences_t, ballots_t, states = task
+    params = explorer_parameters
+    ranks_t = ProfileRanks(preferences_t) if params.ballot_generation.ordinal else None
+    results = []
+    for state in states:
+        profile = decode_state(state,params.abcvoting.m)
+        W, _ = compute_committee(params,profile)
+        successors = []
+        for i in range(len(profile)):
+            for ballot in best_responses(params,preferences_t,ballots_t,i,profile,W,ranks_t):
+                successors.append(encode_state(profile.with_ballot(i,ballot),params.abcvoting.m))
+        results.append((W,successors))
+    return results
+
+
+# ANALYSIS
+# strongly connected components (Tarjan, iterative), successors[v]: successor ids of v (no successors for v >= len)
+def strongly_connected_components(successors, num_states):
+    index, low = [-1]*num_states, [0]*num_states
+    on_stack, stack, components = [False]*num_states, [], []
+    counter = 0
+    for root in range(num_states):
+        if index[root] >= 0:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root,0)]
+        while work:
+            v, j = work[-1]
+            edges = successors[v] if v < len(successors) else ()
+            if j < len(edges):
+                work[-1] = (v,j+1)
+                w = edges[j]
+                if index[w] < 0:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w,0))
+                elif on_stack[w]:
+                    low[v] = min(low[v],index[w])
+                continue
+            work.pop()
+            if work:
+                u = work[-1][0]
+                low[u] = min(low[u],low[v])
+            if low[v] == index[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    component.append(w)
+                    if w == v:
+                        break
+                components.append(component)
+    return components
+
+
+# EXPLORATION
+# explore all profiles reachable from the truthful profile (BallotProfile) by deviations of get_deviation
+# pool: worker pool initialised with init_explorer(params) (None: expand in this process)
+def explore(params:Parameters, preferences_t, ballots_t, election_index=0, pool=None, max_states=MAX_STATES, max_memory_states=MAX_MEMORY_STATES, spill_path=None):
+    m = params.abcvoting.m
+    if pool is None:
+        init_explorer(params)
+    visited = VisitedStates(max_memory_states,spill_path)
+    frontier = [encode_state(ballots_t,m)]
+    visited.add(frontier)
+    # successor ids of expanded profiles: profiles are expanded in the order of their ids (breadth-first)
+    successors, equilibria = [], []
+    distance, depth = 0, 0
+    try:
+        while frontier and len(successors) < max_states:
+            level = frontier[:max_states-len(successors)]
+            tasks = [(preferences_t,ballots_t,level[j:j+CHUNKSIZE]) for j in range(0,len(level),CHUNKSIZE)]
+            results = pool.imap(expand_states,tasks) if pool is not None else map(expand_states,tasks)
+            frontier_next = []
+            for states, chunk in zip((level[j:j+CHUNKSIZE] for j in range(0,len(level),CHUNKSIZE)),results):
+                for state, (W, states_next) in zip(states,chunk):
+                    ids, added = visited.add(states_next)
+                    successors.append(ids)
+                    if not ids:
+                        equilibria.append((decode_state(state,m),from_mask(W),distance))
+                    frontier_next += [state_next for state_next, is_added in zip(states_next,added) if is_added]
+            # profiles of a level that were not expanded (max_states) stay in the frontier
+            frontier = frontier[len(level):] + frontier_next
+            if frontier_next:
+                depth = distance + 1
+            distance += 1
+    finally:
+        num_states = len(visited)
+        visited.close()
+    complete = not frontier
+    # profiles of a component with more than one profile are expanded, a closed component is a cycle that is never left
+    cycles = [component for component in strongly_connected_components(successors,num_states) if len(component) > 1]
+    closed_cycles = sum(all(w in members for v in members for w in successors[v]) for members in map(set,cycles))
+    can_cycle = True if cycles else (False if complete else None)
+    converges_from_all = False if closed_cycles else (True if complete else None)
+    return ExplorationData(election_index,ballots_t,complete,num_states,sum(map(len,successors)),depth,equilibria,
+        sorted(map(len,cycles),reverse=True),closed_cycles,can_cycle,converges_from_all)
+
+# explore the truthful profiles of all elections of a configuration (same profiles as run_profiles for a seeded run,
+# tied profiles are regenerated with skip_ties)
+# processes: number of pool workers (1: no pool, None: all cores)
+def explore_elections(params:Parameters, processes=None, max_states=MAX_STATES, max_memory_states=MAX_MEMORY_STATES):
+    key = configuration_key(params)
+    explorations = []
+    with (Pool(processes,initializer=init_explorer,initargs=(params,)) if processes != 1 else nullcontext()) as pool:
+        for index in range(params.num_elections):
+            if params.execution.seed is not None:
+                seed_election(params.execution.seed,key,index)
+            preferences_t, ballots_t, _, _ = generate_election(params,index)
+            explorations.append(explore(params,preferences_t,ballots_t,index,pool,max_states,max_memory_states))
+            if params.trace:
+                print_dataclass(explorations[-1])
+    return explorations
+
+
+# VERIFICATION
+# compare exploration to get_deviation and iterate_deviations on random small profiles
+# - every deviation returned by get_deviation is a best response, get_deviation returns None iff there is none
+# - iterations that cycle imply can_cycle, iterations that converge end in an equilibrium (except swap_j, see above)
+# - same result with the visited set moved to SQLite and with expansion in pool workers
+# - explore_elections explores the truthful profiles of run_profiles (seeded generated culture with skip_ties)
+# returns list of mismatches (description, parameters, preferences, ballots)
+def check_explorer(num_profiles=100, seed=0, processes=2, max_states=2000):
+    rng = random.Random(seed)
+    random.seed(seed)
+    mismatches, cycling, incomplete = [], 0, 0
+    for test in range(num_profiles):
+        m = rng.randint(2,5)
+        k = rng.randint(1,m-1)
+        n = rng.randint(2,4)
+        ordinal = rng.random() < 0.3
+        if ordinal:
+            preferences_t = [rng.sample(range(m),m) for _ in range(n)]
+            ballots_t = BallotProfile([prefix_masks(preference)[rng.randrange(m)] for preference in preferences_t],m)
+            deviation_type, set_preference = rng.choice(["cutoff","swap_j","brute_force"]), rng.choice(["K","F","PD"])
+        else:
+            preferences_t = None
+            ballots_t = BallotProfile([to_mask(c for c in range(m) if rng.random() < 0.5) or 1 << rng.randrange(m) for _ in range(n)],m)
+            deviation_type, set_preference = rng.choice(["swap_j","brute_force","subset"]), rng.choice(["AV","CCAV"])
+        params = Parameters(1,
+            BallotGenerationParams(True,ordinal,"manual",1,None,None,[ballots_t.to_sets()],[preferences_t],False,None),
+            ABCVotingParams(rng.choice(["av","sav","seqpav","seqcc","seqphragmen"]),n,m,k,rng.random() < 0.5),
+            IterationParams(20*n,rng.random() < 0.5),
+            DeviationParams(deviation_type,1,set_preference,rng.random() < 0.2,rng.random() < 0.5),
+            False,"")
+        mismatch = lambda description: mismatches.append((description,params,preferences_t,ballots_t))
+        exploration = explore(params,preferences_t,ballots_t,test,max_states=max_states)
+        cycling += bool(exploration.can_cycle)
+        incomplete += not exploration.complete
+        # deviations of the truthful profile
+        W_t, _ = compute_committee(params,ballots_t)
+        for i in range(n):
+            responses = best_responses(params,preferences_t,ballots_t,i,ballots_t,W_t)
+            for _ in range(10):
+                deviation = get_deviation(params,preferences_t,ballots_t,i,ballots_t,W_t)
+                if (deviation is None) != (not responses) or (deviation is not None and deviation[0] not in responses):
+                    mismatch("get_deviation of voter " + str(i) + " is not a best response")
+                    break
+        # sampled iterations
+        equilibria = {profile for profile, _, _ in exploration.equilibria}
+        for _ in range(10):
+            iteration_data = iterate_deviations(params,preferences_t,ballots_t,W_t)
+            final = iteration_data.all_deviations.profile(len(iteration_data.all_deviations))
+            if iteration_data.cycled and exploration.can_cycle is False:
+                mismatch("iteration cycles, exploration found no cycle")
+            if iteration_data.converged and exploration.complete and deviation_type != "swap_j" and final not in equilibria:
+                mismatch("iteration converged outside of the equilibria")
+        # spilled visited set, pool workers
+        if explore(params,preferences_t,ballots_t,test,max_states=max_states,max_memory_states=1) != exploration:
+            mismatch("exploration with spilled visited set differs")
+        if test < 10:
+            with Pool(processes,initializer=init_explorer,initargs=(params,)) as pool:
+                if explore(params,preferences_t,ballots_t,test,pool,max_states) != exploration:
+                    mismatch("exploration in pool workers differs")
+    print(str(cycling) + " of " + str(num_profiles) + " profiles can cycle, " + str(incomplete) + " explorations stopped at max_states")
+    # truthful profiles of a seeded simulation (elections finish in any order), irresolute av: tied profiles are regenerated
+    with tempfile.TemporaryDirectory() as directory:
+        params = Parameters(20,
+            BallotGenerationParams(True,False,"impartial",1,None,None,None,None,False,None),
+            ABCVotingParams("av",4,4,2,False),
+            IterationParams(80,False),
+            DeviationParams("brute_force",1,"AV",True),
+            False,directory,ExecutionParams(seed=5))
+        stats = run_profiles(params)
+        explorations = explore_elections(params,processes,max_states)
+        simulated = sorted(tuple(map(to_mask,iteration_data.ballots_truthful)) for iteration_data in stats.iteration_stats.all_iteration_data)
+        if sorted(tuple(exploration.ballots_truthful.masks) for exploration in explorations) != simulated:
+            mismatches.append(("explore_elections explores other truthful profiles than run_profiles",params,None,None))
+    return mismatches
+
+if __name__ == "__main__":
+    mismatches = check_explorer(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
+    for mismatch in mismatches:
+        print("\033[91mMismatch: " + str(mismatch) + "\033[0m")
+    print(str(len(mismatches)) + " mismatches")
@@ -0,0 +1,169 @@
+# basics
+import numpy as np
+
+# IABC
+from types_classes import Parameters
+from basics_and_helpers import compute_committee
+from bitmasks import approval_matrix, candidates, popcount, profile_key
+from rules import ballot_histogram, separable_scale, separable_weight, seq_thiele_marginal, seq_thiele_tied, seq_thiele_weights
+
+"""
+Incremental committee evaluation for single-voter deviations
+the profile of all voters except voter i is fixed, only the ballot of voter i changes
+ballots and committees are bitmasks (see bitmasks.py)
+    - separable rules (av, sav): per-candidate scores of the other voters, one ballot delta per test
+    - sequential Thiele rules (seqpav, seqcc): marginal scores of every round of the base profile,
+      a test ballot only changes the scores of the candidates on the old and the new ballot
+all other rules and all cases not decided by the stored state (ties for resolute=False) use compute_committee
+batches of test ballots (evaluate_batch) are scored at once with NumPy for separable rules (scores must fit into int64)
+"""
+
+# batch size for vectorized evaluation (other modes evaluate ballots one by one)
+BATCH_SIZE = 64
+
+# HELPER FUNCTIONS
+# committee and tie flag of a separable rule from candidate scores (same tie-breaking as abcvoting)
+def separable_committee(scores, k, resolute):
+    cutoff = sorted(scores)[-k]
+    certain = [c for c in range(len(scores)) if scores[c] > cutoff]
+    possible = [c for c in range(len(scores)) if scores[c] == cutoff]
+    missing = k - len(certain)
+    W = 0
+    for c in certain + possible[:missing]:
+        W |= 1 << c
+    return W, (not resolute and len(possible) > missing)
+
+
+# INCREMENTAL EVALUATOR
+class IncrementalEvaluator:
+    # store state of the base profile ballots for deviations of voter i
+    def __init__(self, params:Parameters, ballots, i):
+        self.params = params
+        self.ballots = ballots
+        self.i = i
+        self.m, self.k = params.abcvoting.m, params.abcvoting.k
+        self.resolute = params.abcvoting.resolute
+        abc_rule = params.abcvoting.abc_rule
+        if abc_rule in ["av","sav"]:
+            self.mode = "separable"
+            self.scale = separable_scale(abc_rule,self.m)
+        elif seq_thiele_weights(abc_rule,self.k) is not None:
+            self.mode = "sequential"
+            self.weights = seq_thiele_weights(abc_rule,self.k)
+        else:
+            self.mode = None
+        # state is only built when the first ballot is evaluated
+        self.initialised = False
+
+    # number of ballots get_deviation should pass to evaluate_batch at once
+    @property
+    def batch_size(self):
+        return BATCH_SIZE if self.mode == "separable" and self.m <= 64 else 1
+
+    # build state of the base profile
+    def init_state(self):
+        self.key = profile_key(self.ballots)
+        others = list(self.ballots[:self.i]) + list(self.ballots[self.i+1:])
+        match self.mode:
+            case "separable":
+                self.scores_others = [0]*self.m
+                for ballot in others:
+                    w = separable_weight(self.scale,ballot)
+                    for c in candidates(ballot):
+                        self.scores_others[c] += w
+            case "sequential":
+                self.others = ballot_histogram(others)
+                self.init_rounds(self.ballots[self.i])
+        self.initialised = True
+
+    # compute rounds of the base profile: committee prefix, marginal scores and weight of the old ballot
+    def init_rounds(self, ballot_old):
+        self.ballot_old = candidates(ballot_old)
+        self.path, self.round_scores, self.round_weights_old = [], [], []
+        prefix = 0
+        for _ in range(self.k):
+            scores = self.marginal_scores(prefix,ballot_old)
+            self.round_scores.append(scores)
+            self.round_weights_old.append(self.weights[popcount(ballot_old & prefix)+1])
+            # base path always uses lexicographic tie-breaking, only serves as reference
+            next_c = seq_thiele_tied(scores,prefix)[0]
+            self.path.append(next_c)
+            prefix |= 1 << next_c
+
+    # marginal scores of adding each candidate to prefix for the other voters and ballot of voter i
+    def marginal_scores(self, prefix, ballot_i):
+        return seq_thiele_marginal(self.weights,self.m,self.others + [(ballot_i,1)],prefix)
+
+    # continue a sequential rule from a diverged prefix, returns None if ties require full computation
+    def complete_sequential(self, prefix, ballot):
+        for _ in range(popcount(prefix),self.k):
+            tied_cands = seq_thiele_tied(self.marginal_scores(prefix,ballot),prefix)
+            if len(tied_cands) > 1 and not self.resolute:
+                return None
+            prefix |= 1 << tied_cands[0]
+        return prefix
+
+    # sequential Thiele rule: follow base rounds while the winner of each round is unchanged
+    def evaluate_sequential(self, ballot):
+        ballot_new = candidates(ballot)
+        prefix = 0
+        intersection_new = 0
+        for r in range(self.k):
+            scores = self.round_scores[r][:]
+            w_old = self.round_weights_old[r]
+            w_new = self.weights[intersection_new+1]
+            for c in self.ballot_old:
+                scores[c] -= w_old
+            for c in ballot_new:
+                scores[c] += w_new
+            tied_cands = seq_thiele_tied(scores,prefix)
+            if len(tied_cands) > 1 and not self.resolute:
+                return None
+            next_c = tied_cands[0]
+            prefix |= 1 << next_c
+            if next_c != self.path[r]:
+                return self.complete_sequential(prefix,ballot)
+            if ballot >> next_c & 1:
+                intersection_new += 1
+        return prefix
+
+    # compute committee (bitmask) and tie flag for the base profile with ballot of voter i replaced
+    def evaluate(self, ballot):
+        if not self.initialised:
+            self.init_state()
+        match self.mode:
+            case "separable":
+                scores = self.scores_others[:]
+                w = separable_weight(self.scale,ballot)
+                for c in candidates(ballot):
+                    scores[c] += w
+                return separable_committee(scores,self.k,self.resolute)
+            case "sequential":
+                W = self.evaluate_sequential(ballot)
+                if W is not None:
+                    return W, False
+        # fallback: compute committee for full profile, anonymous key updated by the ballot delta
+        return compute_committee(self.params,self.key.replace(self.ballots[self.i],ballot))
+
+    # separable rule for a batch of ballots: scores of all test profiles as one (ballots x m) matrix
+    # stable sort by descending score keeps the lowest index first among equal scores (same as separable_committee)
+    def evaluate_separable_batch(self, ballots):
+        weights = np.array([separable_weight(self.scale,ballot) for ballot in ballots],dtype=np.int64)
+        scores = np.array(self.scores_others,dtype=np.int64) + approval_matrix(ballots,self.m)*weights[:,None]
+        order = np.argsort(-scores,axis=1,kind="stable")
+        committees = np.bitwise_or.reduce(np.left_shift(np.uint64(1),order[:,:self.k].astype(np.uint64)),axis=1)
+        if self.resolute or self.k == self.m:
+            tied = np.zeros(len(ballots),dtype=bool)
+        else:
+            ranked = np.take_along_axis(scores,order[:,self.k-1:self.k+1],axis=1)
+            tied = ranked[:,0] == ranked[:,1]
+        return list(zip(map(int,committees),map(bool,tied)))
+
+    # committees (bitmasks) and tie flags for a batch of ballots of voter i
+    def evaluate_batch(self, ballots):
+        if not self.initialised:
+            self.init_state()
+        # vectorized scores only if all exact integer scores fit into int64
+        if self.mode == "separable" and self.m <= 64 and (self.scale or 1)*len(self.ballots) < 2**62:
+            return self.evaluate_separable_batch(ballots)
+        return [self.evaluate(ballot) for ballot in ballots]
@@ -1,16 +1,23 @@
 # basics
-import random
+import os, random
+from contextlib import contextmanager
 
 # IABC
 from types_classes import *
-from basics_and_helpers import hashable_set_list, compute_committee, random_list, cycle_list
+from basics_and_helpers import compute_committee, random_list, cycle_list, configuration_key, seed_election
+from bitmasks import Trajectory, approval_matrix, from_mask
 from ballot_generation import generate_ballots
 from deviations import get_deviation
 from properties import check_ejr_plus, check_jr, check_psc
-from stats import get_stats
+from set_preferences import ProfileRanks
+from stats import StatsAccumulator
+from result_store import ResultWriter, merge_shards, shard_indices
+import shared_cache, persistent_cache
 
 # parallelisation
 from multiprocessing import Pool
+# upper bound for tasks per chunk in sweeps
+SWEEP_MAX_CHUNKSIZE = 16
 
 # plotting
 import pandas as pd
@@ -19,10 +26,13 @@ import pandas as pd
 
 # ITERATIONS
 # find and apply improving deviations for all voters in the indices list
+# truthful ballots as BallotProfile, committees as bitmasks
 def iterate_deviations(params:Parameters, preferences_t, ballots_t, W_t):
-    # initialise current ballots and committee
-    ballots_current = ballots_t[:]
+    # initialise current ballots and committee (profiles are immutable)
+    ballots_current = ballots_t
     W_current       = W_t
+    # rank arrays of the truthful preferences for ordinal comparisons (once per profile)
+    ranks_t         = ProfileRanks(preferences_t) if params.ballot_generation.ordinal else None
 
     # initialise iteration list (random or cycling)
     index_list      = cycle_list(params.iteration.max_iterations,params.abcvoting.n) if params.iteration.cycle_iteration else random_list(params.iteration.max_iterations,params.abcvoting.n)
@@ -30,11 +40,13 @@ def iterate_deviations(params:Parameters, preferences_t, ballots_t, W_t):
     # initialise iteration stats
     converged       = True
     cycle           = False
-    all_deviations  = []
+    # deviations as deltas to the truthful profile
+    all_deviations  = Trajectory(ballots_t)
     manipulators    = set()
 
-    # store all profiles seen to detect cycles 
-    profiles_seen   = set()
+    # store fingerprints of all profiles seen to detect cycles (fingerprint -> numbers of deviations applied)
+    # a hit is verified exactly against the profile reconstructed from all_deviations
+    profiles_seen   = {ballots_current.fingerprint(): [0]}
 
     # convergence detection: track last change (cyclic) / track set of non-manipulating voters (random)
     if params.iteration.cycle_iteration:
@@ -52,21 +64,19 @@ def iterate_deviations(params:Parameters, preferences_t, ballots_t, W_t):
             break
         # get next voter i
         i = index_list[j]
-        # store current profile for cycle detection
-        profiles_seen.add(hashable_set_list(ballots_current))
 
         # obtain a best deviation for voter i
-        deviation = get_deviation(params, preferences_t, ballots_t, i, ballots_current[:], W_current)
+        deviation = get_deviation(params, preferences_t, ballots_t, i, ballots_current, W_current, ranks_t)
         # apply deviating ballot if one is found
         if deviation != None:
             # update current ballots
             ballot_i_new, W_new = deviation
-            ballots_current[i] = ballot_i_new
+            ballots_current = ballots_current.with_ballot(i,ballot_i_new)
             W_current = W_new
 
             # track iteration statistics
             converged = False
-            all_deviations.append((i,ballots_current[:],W_current))
+            all_deviations.append(i,ballot_i_new,W_current)
             manipulators.add(i)
             
             # reset convergence detection
@@ -75,38 +85,40 @@ def iterate_deviations(params:Parameters, preferences_t, ballots_t, W_t):
             else:
                 non_manipulators = {i}
 
-            # cycle detection
-            if hashable_set_list(ballots_current) in profiles_seen:
+            # cycle detection (fingerprint updated in O(1) by with_ballot)
+            fingerprint = ballots_current.fingerprint()
+            if any(all_deviations.profile(d) == ballots_current for d in profiles_seen.get(fingerprint,())):
                 cycle = True
                 break
+            profiles_seen.setdefault(fingerprint,[]).append(len(all_deviations))
         elif not params.iteration.cycle_iteration: 
             # optimisation: add to set of non-manipulating voters
             non_manipulators.add(i)
     # compute total manipulators and store iteration stats
-    iteration_data = IterationData(converged,cycle,preferences_t,ballots_t,W_t,W_current,manipulators,all_deviations)
+    iteration_data = IterationData(converged,cycle,preferences_t,ballots_t.to_sets(),from_mask(W_t),from_mask(W_current),manipulators,all_deviations)
     return iteration_data
 
+# generate the truthful profile of an election and compute its committee
+# skip_ties: regenerate until the truthful committee is not tied (same random stream as the simulation, see explorer.py)
+def generate_election(params:Parameters, index):
+    preferences_truthful,profile_truthful,ballots_sampled = generate_ballots(params,index)
+    committee_truthful,tied  = compute_committee(params,profile_truthful)
+
+    while params.deviation.skip_ties and tied:
+        if params.trace: print("\033[91mProfile " + str(index) + " has a tied committee, regenerating preferences ...\033[0m")
+        preferences_truthful,profile_truthful,ballots_sampled = generate_ballots(params,index)
+        committee_truthful,tied  = compute_committee(params,profile_truthful)
+    return preferences_truthful,profile_truthful,committee_truthful,ballots_sampled
+
 # run a single preference profile through iterations, collect and return stats
 def run_profile(index, params:Parameters):
     print("Profile " + str(index))
 
     # generate preferences and ballots, compute truthful committee
-    preferences_truthful,ballots_truthful = generate_ballots(params,index)
-    committee_truthful,tied  = compute_committee(params,ballots_truthful)
-
-    while params.deviation.skip_ties and tied:
-        if params.trace: print("\033[91mProfile " + str(index) + " has a tied committee, regenerating preferences ...\033[0m")
-        preferences_truthful,ballots_truthful = generate_ballots(params,index)
-        committee_truthful,tied  = compute_committee(params,ballots_truthful)
+    preferences_truthful,profile_truthful,committee_truthful,ballots_sampled = generate_election(params,index)
 
     # iterate over the given voters and find improving deviations, collect data
-    iteration_data = iterate_deviations(params,preferences_truthful,ballots_truthful,committee_truthful)
-    # output cycles if found
-    if iteration_data.cycled:
-        with open(params.filename + "/cycles.txt", "a") as f:
-            print("Profile " + str(index),file=f)
-            print_dataclass(iteration_data,file=f)
-            print("-------------------------------------------------",file=f)
+    iteration_data = iterate_deviations(params,preferences_truthful,profile_truthful,committee_truthful)
     # print iteration data for each election if trace enabled
     if params.trace:
         print_dataclass(iteration_data)
@@ -114,24 +126,112 @@ def run_profile(index, params:Parameters):
     # check proportionality violations and return collected data
     if params.ballot_generation.ordinal:
         psc_data = check_psc(params.abcvoting.n,params.abcvoting.m,params.abcvoting.k,preferences_truthful,iteration_data.committee_truthful,iteration_data.committee_final)
-        return ElectionData(index,iteration_data,psc_data,None,None)
+        election_data = ElectionData(index,iteration_data,psc_data,None,None,ballots_sampled)
     else:
-        ejrplus_data = check_ejr_plus(params.abcvoting.n,params.abcvoting.m,params.abcvoting.k,ballots_truthful,committee_truthful,iteration_data.committee_final)
-        jr_data = check_jr(params.abcvoting.n,params.abcvoting.m,params.abcvoting.k,ballots_truthful,committee_truthful,iteration_data.committee_final)
-        return ElectionData(index,iteration_data,None,jr_data,ejrplus_data)
-
-def run_profile_wrapper(args):
-    return run_profile(*args)
-
-# run num_elections profiles for the given parameters, collect and return stats
+        approvals = approval_matrix(profile_truthful.masks,params.abcvoting.m)
+        ejrplus_data = check_ejr_plus(params.abcvoting.n,params.abcvoting.m,params.abcvoting.k,approvals,iteration_data.committee_truthful,iteration_data.committee_final)
+        jr_data = check_jr(params.abcvoting.n,params.abcvoting.m,params.abcvoting.k,approvals,iteration_data.committee_truthful,iteration_data.committee_final)
+        election_data = ElectionData(index,iteration_data,None,jr_data,ejrplus_data,ballots_sampled)
+    # publish cache counters and write buffered committees of this worker
+    shared_cache.flush_counters()
+    persistent_cache.flush()
+    return election_data
+
+# parameters of all configurations of the current pool and their keys for seeding (set in pool workers by init_worker)
+worker_parameters = None
+worker_configuration_keys = None
+
+# pool initializer: receive parameters (incl. manual profiles) once per worker, attach shared and persistent committee caches
+def init_worker(cache, committee_store, parameters_list):
+    global worker_parameters, worker_configuration_keys
+    worker_parameters = parameters_list
+    worker_configuration_keys = [configuration_key(params) for params in parameters_list]
+    shared_cache.attach(cache)
+    persistent_cache.attach(committee_store)
+
+# task: (configuration index, election index), parameters are looked up in the worker
+def run_task(task):
+    c, index = task
+    params = worker_parameters[c]
+    if params.execution.seed is not None:
+        seed_election(params.execution.seed,worker_configuration_keys[c],index)
+    return c, run_profile(index,params)
+
+# worker pool for the given configurations with committee caches attached (shared cache allocated before the pool is created)
+@contextmanager
+def committee_pool(execution:ExecutionParams, parameters_list:list[Parameters]):
+    cache = shared_cache.SharedCommitteeCache(execution.shared_cache_size) if execution.shared_cache_size > 0 else None
+    if execution.committee_store is not None:
+        persistent_cache.open_store(execution.committee_store,execution.committee_store_max_entries)
+    with Pool(initializer=init_worker,initargs=(cache,execution.committee_store,parameters_list)) as pool:
+        yield pool
+    if cache is not None:
+        print(cache.report())
+    if execution.committee_store is not None:
+        size = persistent_cache.close_store(execution.committee_store,execution.committee_store_max_entries)
+        print("Persistent committee store: " + str(size) + " committees")
+
+# run num_elections profiles for the given parameters, collect and return stats (None in shard mode)
 def run_profiles(params:Parameters):
-    with Pool() as pool:
-        data_total = list(pool.imap_unordered(run_profile_wrapper,[(i, params) for i in range(params.num_elections)]))
-
-    # filter out None and check for empty result
-    iteration_data_total = list(filter(lambda x: x != None, data_total))
-    if iteration_data_total == []:
-        print("\033[91mNo data collected, probably only tied committees.\033[0m")
-        raise ValueError
-
-    return get_stats(params.abcvoting.n,params.ballot_generation.ordinal,iteration_data_total)
+    stats_total = [None]
+    run_sweep([params],lambda c, params, stats: stats_total.__setitem__(0,stats))
+    return stats_total[0]
+
+
+# SWEEPS
+# chunks small enough to keep all workers busy until the end of the sweep (at least 8 chunks per worker)
+def sweep_chunksize(num_tasks, processes):
+    return max(1,min(SWEEP_MAX_CHUNKSIZE,num_tasks // (8*processes)))
+
+# run the elections of several configurations in one pool (execution parameters of the first configuration)
+# tasks are ordered by configuration, results are aggregated and written to the result store (see result_store.py) as they arrive,
+# on_finished(c, params, stats) is called as soon as configuration c is complete
+# resume: elections already in the result store of a configuration are not run again, their stored data is aggregated
+# shard mode (ExecutionParams.shard): only the elections of the shard are run and stored, on_finished is not called,
+# a later run without shard merges the stores of all shards and aggregates them (identical to a single run if seeded)
+def run_sweep(parameters_list:list[Parameters], on_finished):
+    sharded = parameters_list[0].execution.shard is not None
+    if not sharded:
+        for params in parameters_list:
+            merged = merge_shards(params.filename)
+            if merged > 0:
+                print("Merged " + str(merged) + " elections of shards in " + params.filename)
+    writers = [ResultWriter(params) for params in parameters_list]
+    accumulators = [StatsAccumulator(params.ballot_generation.ordinal,params.execution.keep_election_data) for params in parameters_list]
+    completed = [set() for _ in parameters_list]
+    for c in range(len(parameters_list)):
+        for election_data in writers[c].completed():
+            accumulators[c].add(election_data)
+            completed[c].add(election_data.election_index)
+    indices = [shard_indices(params.num_elections,params.execution.shard) for params in parameters_list]
+    tasks = [(c, index) for c in range(len(parameters_list)) for index in indices[c] if index not in completed[c]]
+    remaining = [len(indices[c]) - len(completed[c]) for c in range(len(parameters_list))]
+
+    def finish(c):
+        writers[c].close()
+        if sharded:
+            print("Shard " + str(parameters_list[c].execution.shard) + " of " + parameters_list[c].filename + " finished")
+            writers[c], accumulators[c] = None, None
+            return
+        # check for empty result
+        if accumulators[c].num_elections == 0:
+            print("\033[91mNo data collected, probably only tied committees.\033[0m")
+            raise ValueError
+        on_finished(c,parameters_list[c],accumulators[c].result())
+        # release data of finished configuration
+        writers[c], accumulators[c] = None, None
+
+    for c in range(len(parameters_list)):
+        if remaining[c] == 0:
+            finish(c)
+    if tasks == []:
+        return
+    with committee_pool(parameters_list[0].execution,parameters_list) as pool:
+        for c, election_data in pool.imap_unordered(run_task,tasks,chunksize=sweep_chunksize(len(tasks),os.cpu_count())):
+            # skip None (tied profiles)
+            if election_data != None:
+                accumulators[c].add(election_data)
+                writers[c].add(election_data)
+            remaining[c] -= 1
+            if remaining[c] == 0:
+                finish(c)
@@ -6,6 +6,8 @@ from itertools import chain, combinations, product
 from types_classes import *
 from parameters import set_params
 from iterations import run_profiles
+from explorer import explore_elections
+from result_store import render_cycles, render_log
 
 ## PARAMETERS
 num_elections       = 50
@@ -54,9 +56,23 @@ swap_j              = 3
 set_preference      = "AV"
 # restrict search to profiles with unique winning committee (sets resolute to False!)
 skip_ties           = False
+# restrict deviations to ballots of best-response oracles where available (brute_force, subset; see oracles.py)
+best_response_oracle = False
 
 trace               = False
 
+# EXECUTION
+# SQLite file reusing computed committees across runs (None: disabled)
+committee_store     = None
+# keep data of single elections in memory (stats.all_*_data), log is written while elections finish
+keep_election_data  = True
+# master seed of the per-election random streams, reproducible runs (None: unseeded)
+seed                = None
+
+# ANALYSIS
+# explore all profiles reachable from each truthful profile instead of sampling voter orders (see explorer.py)
+explore_states      = False
+
 
 # run once for fixed (global) parameters
 def run_batch():
@@ -64,7 +80,7 @@ def run_batch():
     filename = "filepath/" + abc_rule.upper() + "/n" + str(n) + " m" + str(m) + " k" + str(k) + " x" + str(num_elections) + " " + str(datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S"))
     os.mkdir(filename)
     # set parameters and run elections
-    parameters = set_params(num_elections,skip_empty_ballots,ordinal,culture,avg_ballot_size,alpha,phi,manual_ballots,manual_preference,random_cutoff,cutoff_points,abc_rule,n,m,k,resolute,max_iterations,cycle_iteration,deviation_type,swap_j,set_preference,skip_ties,trace,filename)
+    parameters = set_params(num_elections,skip_empty_ballots,ordinal,culture,avg_ballot_size,alpha,phi,manual_ballots,manual_preference,random_cutoff,cutoff_points,abc_rule,n,m,k,resolute,max_iterations,cycle_iteration,deviation_type,swap_j,set_preference,skip_ties,trace,filename,best_response_oracle=best_response_oracle,committee_store=committee_store,keep_election_data=keep_election_data,seed=seed)
     stats = run_profiles(parameters)
     # write parameters and stats to file
     with open(parameters.filename + "/params_stats.txt", "a") as f:
@@ -81,10 +97,37 @@ def run_batch():
     print("Stats:")
     print_dataclass(stats)
     print("-------------------------------------------------\033[0m")
-    # write log to file
-    write_log(stats,parameters)
+    # render logs from result store
+    with open(parameters.filename + "/full_log.txt", "w") as f:
+        render_log(parameters.filename,file=f)
+    with open(parameters.filename + "/cycles.txt", "w") as f:
+        render_cycles(parameters.filename,file=f)
+
+# explore the deviation dynamics of the truthful profiles for fixed (global) parameters
+def run_exploration():
+    # set file output path
+    filename = "filepath/" + abc_rule.upper() + "/n" + str(n) + " m" + str(m) + " k" + str(k) + " x" + str(num_elections) + " explore " + str(datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S"))
+    os.mkdir(filename)
+    parameters = set_params(num_elections,skip_empty_ballots,ordinal,culture,avg_ballot_size,alpha,phi,manual_ballots,manual_preference,random_cutoff,cutoff_points,abc_rule,n,m,k,resolute,max_iterations,cycle_iteration,deviation_type,swap_j,set_preference,skip_ties,trace,filename,best_response_oracle=best_response_oracle,committee_store=committee_store,keep_election_data=keep_election_data,seed=seed)
+    explorations = explore_elections(parameters)
+    # write explorations to file
+    with open(parameters.filename + "/exploration.txt", "w") as f:
+        print("Parameters:",file=f)
+        print_dataclass(parameters,file=f)
+        for exploration in explorations:
+            print("-------------------------------------------------",file=f)
+            print_dataclass(exploration,file=f)
+    # print summary to console
+    print("\033[92m-------------------------------------------------")
+    print("Profiles that can cycle:\t\t" + str(sum(exploration.can_cycle is True for exploration in explorations)) + " of " + str(len(explorations)))
+    print("Profiles that can get stuck in a cycle:\t" + str(sum(exploration.converges_from_all is False for exploration in explorations)) + " of " + str(len(explorations)))
+    print("Explorations stopped at max_states:\t" + str(sum(not exploration.complete for exploration in explorations)))
+    print("-------------------------------------------------\033[0m")
 
 
 if __name__ == "__main__":
-    run_batch()
+    if explore_states:
+        run_exploration()
+    else:
+        run_batch()
 
@@ -0,0 +1,85 @@
+# basics
+import random, sys
+
+# IABC
+from types_classes import *
+from bitmasks import all_masks, submasks, to_mask
+from incremental import IncrementalEvaluator
+from set_preferences import U_AV_mask, U_CCAV_mask
+
+"""
+Best-response oracles for (abc_rule, set_preference) pairs (opt-in: DeviationParams.best_response_oracle)
+an oracle returns a small set of ballots that contains a best response of voter i among all ballots,
+get_deviation then only tests these ballots instead of enumerating the full ballot space
+dichotomous utilities (AV, CCAV) only depend on t = |A_i ∩ W| and are non-decreasing in t
+separable rules (av, sav) select the k best candidates by (score, lowest index):
+if every approved candidate gains score and every other candidate loses score, the order statistics of
+approved candidates rise, those of all other candidates fall, so t can only increase
+    - av: the truthful ballot A_i gives +1 to every approved and +0 to every other candidate, it is a best response
+    - sav: for every ballot B, B ∩ A_i (or a single approved candidate if empty) is at least as good,
+      only the non-empty subsets of A_i need to be tested
+oracles are only valid if the deviation type allows all these ballots (brute_force, subset) and ties are not skipped
+all other cases use the exhaustive enumeration of get_deviation_ballots
+"""
+
+# truthful ballot as only candidate for a best response
+def truthful_response(params:Parameters, ballots_t, i):
+    return [ballots_t[i]] if ballots_t[i] else []
+
+# non-empty subsets of the truthful ballot
+def approved_subsets(params:Parameters, ballots_t, i):
+    return submasks(ballots_t[i])
+
+ORACLES = {
+    ("av","AV"): truthful_response,
+    ("av","CCAV"): truthful_response,
+    ("sav","AV"): approved_subsets,
+    ("sav","CCAV"): approved_subsets,
+}
+
+# ballots containing a best response of voter i, None if no oracle applies
+def best_response_ballots(params:Parameters, ballots_t, i):
+    if not params.deviation.best_response_oracle or params.deviation.skip_ties or params.ballot_generation.ordinal:
+        return None
+    if params.deviation.deviation_type not in ["brute_force","subset"]:
+        return None
+    oracle = ORACLES.get((params.abcvoting.abc_rule,params.deviation.set_preference))
+    if oracle is None:
+        return None
+    return oracle(params,ballots_t,i)
+
+
+# VERIFICATION
+# compare best utility reachable with oracle ballots to exhaustive search over all ballots
+# returns list of mismatches (rule, set preference, resolute, m, k, voter, ballots_t, ballots, expected, actual)
+def check_oracles(num_profiles=300, max_n=8, max_m=7, seed=0):
+    rng = random.Random(seed)
+    mismatches = []
+    for _ in range(num_profiles):
+        m = rng.randint(1,max_m)
+        k = rng.randint(1,m)
+        n = rng.randint(1,max_n)
+        ballots_t = [to_mask(c for c in range(m) if rng.random() < 0.4) for _ in range(n)]
+        ballots = [rng.choice(all_masks(m)) for _ in range(n)]
+        for (abc_rule, set_preference), oracle in ORACLES.items():
+            utility = U_AV_mask if set_preference == "AV" else U_CCAV_mask
+            for resolute in [True, False]:
+                params = Parameters(1,
+                    BallotGenerationParams(True,False,"manual",1,None,None,[ballots_t],None,None,None),
+                    ABCVotingParams(abc_rule,n,m,k,resolute),
+                    IterationParams(1,True),
+                    DeviationParams("brute_force",None,set_preference,False,True),
+                    False,"")
+                for i in range(n):
+                    evaluator = IncrementalEvaluator(params,ballots,i)
+                    best = lambda space: max([utility(ballots_t[i],evaluator.evaluate(ballot)[0]) for ballot in space] + [utility(ballots_t[i],evaluator.evaluate(ballots[i])[0])])
+                    expected, actual = best(all_masks(m)), best(oracle(params,ballots_t,i))
+                    if expected != actual:
+                        mismatches.append((abc_rule,set_preference,resolute,m,k,i,ballots_t,ballots,expected,actual))
+    return mismatches
+
+if __name__ == "__main__":
+    mismatches = check_oracles(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
+    for mismatch in mismatches:
+        print("\033[91mMismatch: " + str(mismatch) + "\033[0m")
+    print(str(len(mismatches)) + " mismatches")
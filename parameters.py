@@ -56,6 +56,13 @@ def check_params(params:Parameters):
         print("\033[91mCutoff Parameters invalid\033[0m")
         return valid
 
+    valid = valid and params.execution.shared_cache_size >= 0 and params.execution.committee_store_max_entries > 0 and params.execution.checkpoint_interval >= 0 and params.execution.response_cache_entries >= 0
+    valid = valid and (params.execution.seed is None or params.execution.seed >= 0)
+    valid = valid and (params.execution.shard is None or 0 <= params.execution.shard[0] < params.execution.shard[1])
+    if not valid:
+        print("\033[91mExecution Parameters invalid\033[0m")
+        return valid
+
     if params.ballot_generation.ordinal:
         valid = valid and params.deviation.set_preference in ["PD","K","F"] and params.ballot_generation.culture in ["impartial","urn","manual"]
     else:
@@ -67,7 +74,7 @@ def check_params(params:Parameters):
     return valid
 
 # convert parameters to dataclass format, set unused parameters to None, check for validity
-def set_params(num_elections,skip_empty_ballots,ordinal,culture,avg_ballot_size,alpha,phi,manual_ballots,manual_preference,random_cutoff,cutoff_points,abc_rule,n,m,k,resolute,max_iterations,cycle_iteration,deviation_type,swap_j,set_preference,skip_ties,trace,filename):
+def set_params(num_elections,skip_empty_ballots,ordinal,culture,avg_ballot_size,alpha,phi,manual_ballots,manual_preference,random_cutoff,cutoff_points,abc_rule,n,m,k,resolute,max_iterations,cycle_iteration,deviation_type,swap_j,set_preference,skip_ties,trace,filename,best_response_oracle=False,shared_cache_size=2**20,committee_store=None,committee_store_max_entries=10**8,keep_election_data=True,checkpoint_interval=300,seed=None,shard=None,response_cache_entries=2**19):
     # set unused parameters to None
     if random_cutoff:
         cutoff_points = None
@@ -101,9 +108,10 @@ def set_params(num_elections,skip_empty_ballots,ordinal,culture,avg_ballot_size,
     ballot_generation_params = BallotGenerationParams(skip_empty_ballots, ordinal, culture, avg_ballot_size, alpha, phi, manual_ballots, manual_preference, random_cutoff, cutoff_points)
     abc_voting_params = ABCVotingParams(abc_rule, n, m, k, resolute)
     iteration_params = IterationParams(max_iterations, cycle_iteration)
-    deviation_params = DeviationParams(deviation_type, swap_j, set_preference, skip_ties)
+    deviation_params = DeviationParams(deviation_type, swap_j, set_preference, skip_ties, best_response_oracle)
+    execution_params = ExecutionParams(shared_cache_size, committee_store, committee_store_max_entries, keep_election_data, checkpoint_interval, seed, shard, response_cache_entries)
 
-    parameters = Parameters(num_elections, ballot_generation_params, abc_voting_params, iteration_params, deviation_params, trace, filename)
+    parameters = Parameters(num_elections, ballot_generation_params, abc_voting_params, iteration_params, deviation_params, trace, filename, execution_params)
 
     # check if parameters are valid
     if not check_params(parameters):
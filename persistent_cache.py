@@ -0,0 +1,118 @@
+# basics
+import hashlib
+import sqlite3
+from functools import lru_cache
+from importlib.metadata import version as package_version
+
+# IABC
+from rules import NATIVE_RULES, RULE_VERSION
+
+"""
+Persistent committee store (SQLite), reused across runs and sweeps (L3 behind the shared cache, see shared_cache.py)
+one row per computed committee:
+    key: abc_rule, m, k, resolute, rule version, 128-bit hash of the canonical ballots
+    value: committee bitmask (decimal text, NULL if no committee) and tie flag
+    - WAL journal: pool workers read concurrently while other workers write
+    - writes are buffered per worker and committed in batches
+    - rows of other rule versions are removed and the store is pruned to max_entries when it is opened
+the rule version changes whenever an implementation changes its results (RULE_VERSION in rules.py, abcvoting version for all other rules)
+"""
+
+BATCH_SIZE = 1000
+# seconds a connection waits for the write lock of another worker
+TIMEOUT = 60
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS committees (
+    abc_rule TEXT, m INTEGER, k INTEGER, resolute INTEGER, version TEXT, profile BLOB,
+    committee TEXT, tied INTEGER,
+    PRIMARY KEY (abc_rule, m, k, resolute, version, profile))"""
+
+# connection and buffered writes of the current process (set in pool workers by attach)
+connection = None
+pending = []
+
+
+# HELPER FUNCTIONS
+# version stamp of the implementation computing abc_rule
+@lru_cache(maxsize=None)
+def rule_version(abc_rule):
+    if abc_rule in NATIVE_RULES or abc_rule == "thiele_manual":
+        return "iabc-" + str(RULE_VERSION)
+    return "abcvoting-" + package_version("abcvoting")
+
+# 128-bit hash of the canonical (sorted) ballots
+def profile_hash(ballots):
+    return hashlib.blake2b(repr(tuple(ballots)).encode(),digest_size=16).digest()
+
+# row key of a cache key (abc_rule, m, k, resolute, ballots)
+def row_key(key):
+    abc_rule, m, k, resolute, ballots = key
+    return abc_rule, m, k, int(resolute), rule_version(abc_rule), profile_hash(ballots)
+
+def connect(path):
+    con = sqlite3.connect(path,timeout=TIMEOUT)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    return con
+
+
+# STORE MAINTENANCE (main process)
+# create store if necessary, remove stale rule versions and prune to max_entries (oldest rows first)
+def open_store(path, max_entries):
+    con = connect(path)
+    with con:
+        con.execute(SCHEMA)
+        rows = con.execute("SELECT DISTINCT abc_rule, version FROM committees").fetchall()
+        for abc_rule, version in rows:
+            if version != rule_version(abc_rule):
+                con.execute("DELETE FROM committees WHERE abc_rule = ? AND version = ?",(abc_rule,version))
+        prune(con,max_entries)
+    con.close()
+
+def prune(con, max_entries):
+    excess = con.execute("SELECT COUNT(*) FROM committees").fetchone()[0] - max_entries
+    if excess > 0:
+        con.execute("DELETE FROM committees WHERE rowid IN (SELECT rowid FROM committees ORDER BY rowid LIMIT ?)",(excess,))
+
+# prune store after a run, returns number of stored committees
+def close_store(path, max_entries):
+    con = connect(path)
+    with con:
+        prune(con,max_entries)
+    size = con.execute("SELECT COUNT(*) FROM committees").fetchone()[0]
+    con.close()
+    return size
+
+
+# WORKER SIDE
+# pool initializer: use persistent store in this worker (path None: disabled)
+def attach(path):
+    global connection
+    connection = connect(path) if path is not None else None
+    pending.clear()
+
+# returns (W, tied) or None if key is not stored
+def lookup(key):
+    if connection is None:
+        return None
+    row = connection.execute("SELECT committee, tied FROM committees WHERE abc_rule = ? AND m = ? AND k = ? AND resolute = ? AND version = ? AND profile = ?",row_key(key)).fetchone()
+    if row is None:
+        return None
+    return (None if row[0] is None else int(row[0])), bool(row[1])
+
+# buffer (W, tied) for key, written with the next batch
+def store(key, result):
+    if connection is None:
+        return
+    W, tied = result
+    pending.append(row_key(key) + ((None if W is None else str(W)), int(tied)))
+    if len(pending) >= BATCH_SIZE:
+        flush()
+
+# write buffered committees in one transaction
+def flush():
+    if connection is None or pending == []:
+        return
+    with connection:
+        connection.executemany("INSERT OR IGNORE INTO committees VALUES (?,?,?,?,?,?,?,?)",pending)
+    pending.clear()
@@ -1,9 +1,27 @@
-import math
+import math, random, sys
+import numpy as np
 
 from types_classes import EJRPlusData, JRData, PSCData
 from set_preferences import U_AV
 from basics_and_helpers import support_set
+from bitmasks import approval_matrix, from_mask, popcount, to_mask
 
+"""
+JR and EJR+ are checked on the n x m boolean approval matrix of the truthful ballots (see approval_matrix):
+supports, unrepresented voters, per-voter utility |A_i ∩ W| and the sizes of l-deprived groups are computed in bulk,
+only the selection of the largest violation iterates over candidates (same order and tie-breaking as the set-based versions)
+PSC is checked on an index of all solid coalitions (voters sharing the set of their top i candidates, i < m), built in one pass
+over the prefixes of all rankings and shared by the truthful and final committee
+the set-based versions are kept as reference (check_properties)
+"""
+
+# committee as boolean vector over candidates
+def committee_vector(m, W):
+    w = np.zeros(m,dtype=bool)
+    w[list(W)] = True
+    return w
+
+# JR: find largest JR violation (set-based reference)
 def jr_violation_max(n, m, k, approval_sets, W):
     n_div_k = math.ceil(n/k)
     # initialise maximum violation
@@ -19,7 +37,17 @@ def jr_violation_max(n, m, k, approval_sets, W):
     # return candidate, voter set with with largest JR violation
     return max_candidate, max_set
 
-# EJR+: find largest EJR+ violation
+# JR on approval matrix: first candidate with the most unrepresented supporters (at least n/k)
+def jr_violation_max_matrix(n, m, k, approvals, W):
+    w = committee_vector(m,W)
+    unrepresented = ~approvals[:,w].any(axis=1)
+    counts = np.where(w,-1,approvals[unrepresented].sum(axis=0))
+    c = int(np.argmax(counts))
+    if counts[c] < math.ceil(n/k):
+        return None, set()
+    return c, set(np.flatnonzero(approvals[:,c] & unrepresented).tolist())
+
+# EJR+: find largest EJR+ violation (set-based reference)
 # returns candidate, l-deprived set and l-value of largest EJR+ violation
 # returns (None, set(), None) if no EJR+ violation is found
 def ejr_plus_violation_max(n, m, k, approval_sets, W):
@@ -42,8 +70,29 @@ def ejr_plus_violation_max(n, m, k, approval_sets, W):
                 voters_c = deprived_set_c.copy()
     return max_candidate, max_set, max_l
 
+# EJR+ on approval matrix
+# deprived[c][l-1]: supporters of c represented by <l candidates in W (voters with utility t counted for all l > t)
+def ejr_plus_violation_max_matrix(n, m, k, approvals, W):
+    w = committee_vector(m,W)
+    utility = approvals[:,w].sum(axis=1)
+    supporters = approvals.sum(axis=0).tolist()
+    by_utility = approvals.T.astype(np.int64) @ (utility[:,None] == np.arange(k)).astype(np.int64)
+    deprived = np.cumsum(by_utility,axis=1).tolist()
+    max_candidate, max_size, max_l = None, 0, None
+    for c in range(m):
+        if w[c]:
+            continue
+        # largest l with enough l-deprived supporters that improves on the largest violation so far
+        for l in range(min(k,math.ceil(supporters[c]/(n/k))),0,-1):
+            if deprived[c][l-1] >= max(max_size+1,int(math.ceil(l*(n/k)))):
+                max_candidate, max_size, max_l = c, deprived[c][l-1], l
+                break
+    if max_candidate is None:
+        return None, set(), None
+    return max_candidate, set(np.flatnonzero(approvals[:,max_candidate] & (utility < max_l)).tolist()), max_l
+
 # Proportionality for Solid Coalitions
-# find PSC violation using Hare quota (n/k)
+# find PSC violation using Hare quota (n/k) (set-based reference)
 def psc_violation(n, m, k, preferences_truthful, W):
     quota = n/k
     checked_cutoffs = set()
@@ -69,19 +118,86 @@ def psc_violation(n, m, k, preferences_truthful, W):
     # return coalition, cutoff and l-value of largest PSC violation
     return max_coalition, max_cutoff, max_l
 
-# check truthful and final committee for EJR+ violations
-def check_ejr_plus(n, m, k, ballots_truthful, W_truthful, W_final):
-    candidate_t,unrep_set_t,l_t   = ejr_plus_violation_max(n,m,k,ballots_truthful,W_truthful)
-    candidate_f,unrep_set_f,l_f   = ejr_plus_violation_max(n,m,k,ballots_truthful,W_final)
+# PSC index: coalitions of voters with the same prefix set (bitmask) of length 1 to m-1, only coalitions of size at least quota
+# in the order psc_violation finds them (lowest voter first, then longer prefixes)
+def psc_index(n, m, k, preferences_truthful):
+    quota = n/k
+    coalitions = {}
+    for v in range(n):
+        prefix = 0
+        for c in preferences_truthful[v][:m-1]:
+            prefix |= 1 << c
+            coalitions.setdefault(prefix,[]).append(v)
+    solid = [(prefix, voters) for prefix, voters in coalitions.items() if len(voters) >= quota]
+    solid.sort(key=lambda x: (x[1][0],-popcount(x[0])))
+    return solid
+
+# PSC on index: largest coalition with fewer than min(l, |cutoff|) candidates of its cutoff in W
+def psc_violation_index(n, m, k, index, W):
+    quota = n/k
+    w = to_mask(W)
+    max_coalition, max_cutoff, max_l = [], None, None
+    for prefix, voters in index:
+        # cutoffs contained in W are satisfied
+        if prefix & ~w == 0:
+            continue
+        l = len(voters)//quota
+        if popcount(prefix & w) < min(l,popcount(prefix)) and len(voters) > len(max_coalition):
+            max_coalition, max_cutoff, max_l = voters, prefix, l
+    return set(max_coalition), None if max_cutoff is None else from_mask(max_cutoff), max_l
+
+# check truthful and final committee for EJR+ violations (approvals: approval matrix of the truthful ballots)
+def check_ejr_plus(n, m, k, approvals, W_truthful, W_final):
+    candidate_t,unrep_set_t,l_t   = ejr_plus_violation_max_matrix(n,m,k,approvals,W_truthful)
+    candidate_f,unrep_set_f,l_f   = ejr_plus_violation_max_matrix(n,m,k,approvals,W_final)
     return EJRPlusData(candidate_t,unrep_set_t,l_t,candidate_f,unrep_set_f,l_f)
 
-# check truthful and final committee for JR violations
-def check_jr(n, m, k, ballots_truthful, W_truthful, W_final):
-    candidate_t,unrep_set_t   = jr_violation_max(n,m,k,ballots_truthful,W_truthful)
-    candidate_f,unrep_set_f   = jr_violation_max(n,m,k,ballots_truthful,W_final)
+# check truthful and final committee for JR violations (approvals: approval matrix of the truthful ballots)
+def check_jr(n, m, k, approvals, W_truthful, W_final):
+    candidate_t,unrep_set_t   = jr_violation_max_matrix(n,m,k,approvals,W_truthful)
+    candidate_f,unrep_set_f   = jr_violation_max_matrix(n,m,k,approvals,W_final)
     return JRData(candidate_t,unrep_set_t,candidate_f,unrep_set_f)
 
+# check truthful and final committee for PSC violations (one index of solid coalitions)
 def check_psc(n, m, k, preferences_truthful, W_truthful, W_final):
-    coalition_t, cutoff_t, l_t = psc_violation(n,m,k,preferences_truthful,W_truthful)
-    coalition_f, cutoff_f, l_f = psc_violation(n,m,k,preferences_truthful,W_final)
-    return PSCData(coalition_t,cutoff_t,l_t,coalition_f,cutoff_f,l_f)
\ No newline at end of file
+    index = psc_index(n,m,k,preferences_truthful)
+    coalition_t, cutoff_t, l_t = psc_violation_index(n,m,k,index,W_truthful)
+    coalition_f, cutoff_f, l_f = psc_violation_index(n,m,k,index,W_final)
+    return PSCData(coalition_t,cutoff_t,l_t,coalition_f,cutoff_f,l_f)
+
+
+# VERIFICATION
+# compare JR and EJR+ on the approval matrix and PSC on the index to the set-based reference for random profiles and committees
+# returns list of mismatches (property, n, m, k, approval_sets or preferences, W, expected, actual)
+def check_properties(num_profiles=2000, max_n=12, max_m=8, seed=0):
+    rng = random.Random(seed)
+    mismatches = []
+    for _ in range(num_profiles):
+        n, m = rng.randint(1,max_n), rng.randint(1,max_m)
+        k = rng.randint(1,m)
+        p = rng.random()
+        approval_sets = [{c for c in range(m) if rng.random() < p} for _ in range(n)]
+        # random committee or committee of the least approved candidates (many violations)
+        W = set(rng.sample(range(m),k)) if rng.random() < 0.5 else set(sorted(range(m),key=lambda c: len(support_set(approval_sets,c)))[:k])
+        approvals = approval_matrix([to_mask(A_i) for A_i in approval_sets],m)
+        for name, reference, vectorized in [("JR",jr_violation_max,jr_violation_max_matrix),("EJR+",ejr_plus_violation_max,ejr_plus_violation_max_matrix)]:
+            expected, actual = reference(n,m,k,approval_sets,W), vectorized(n,m,k,approvals,W)
+            if expected != actual:
+                mismatches.append((name,n,m,k,approval_sets,W,expected,actual))
+        # ordinal profile with few distinct rankings (large solid coalitions)
+        rankings = [rng.sample(range(m),m) for _ in range(rng.randint(1,4))]
+        preferences = [list(rng.choice(rankings)) for _ in range(n)]
+        for v in range(n):
+            if rng.random() < 0.3:
+                i, j = rng.randrange(m), rng.randrange(m)
+                preferences[v][i], preferences[v][j] = preferences[v][j], preferences[v][i]
+        expected, actual = psc_violation(n,m,k,preferences,W), psc_violation_index(n,m,k,psc_index(n,m,k,preferences),W)
+        if expected != actual:
+            mismatches.append(("PSC",n,m,k,preferences,W,expected,actual))
+    return mismatches
+
+if __name__ == "__main__":
+    mismatches = check_properties(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
+    for mismatch in mismatches:
+        print("\033[91mMismatch: " + str(mismatch) + "\033[0m")
+    print(str(len(mismatches)) + " mismatches")
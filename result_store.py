@@ -0,0 +1,365 @@
+# basics
+import os, shutil, sys, time
+import numpy as np
+
+# IABC
+from types_classes import *
+from bitmasks import BallotProfile, Trajectory, from_mask, to_mask
+from stats import avg_voter_welfare_AV
+
+"""
+Columnar result store (NumPy), replaces the text logs and the pickled DataFrame of dataclasses
+layout of a store directory (one per configuration, one for the configurations of a sweep):
+    <table>/chunk_<i>/<column>.npy
+tables:
+    - elections: one row per election, flattened parameters, iteration outcome, welfare, JR/EJR+/PSC fields
+    - deviations: one row per deviation (election index, step, voter, new ballot, new committee)
+    - configurations: one row per configuration of a sweep, flattened parameters and stats
+rows are buffered and written in chunks of BATCH_SIZE rows, every column is a separate .npy file,
+so reads only touch the selected columns and are memory-mapped
+sets are stored as bitmasks in little-endian bytes (u1 arrays), None as -1 (integers) or NaN (floats)
+text logs (full_log.txt, cycles.txt) are rendered from the store on demand
+sharded runs (ExecutionParams.shard) write to store_shard_<i>_of_<s> next to the store, merge_shards moves their chunks into the store
+"""
+
+BATCH_SIZE = 1000
+
+# flattened parameters: column, dtype, (parameter group, field)
+PARAMETER_COLUMNS = [
+    ("abc_rule", "U40", ("abcvoting","abc_rule")),
+    ("n", "i4", ("abcvoting","n")),
+    ("m", "i4", ("abcvoting","m")),
+    ("k", "i4", ("abcvoting","k")),
+    ("resolute", "?", ("abcvoting","resolute")),
+    ("ordinal", "?", ("ballot_generation","ordinal")),
+    ("culture", "U20", ("ballot_generation","culture")),
+    ("avg_ballot_size", "f8", ("ballot_generation","avg_ballot_size")),
+    ("alpha", "f8", ("ballot_generation","alpha")),
+    ("phi", "f8", ("ballot_generation","phi")),
+    ("max_iterations", "i4", ("iteration","max_iterations")),
+    ("cycle_iteration", "?", ("iteration","cycle_iteration")),
+    ("deviation_type", "U20", ("deviation","deviation_type")),
+    ("swap_j", "i4", ("deviation","swap_j")),
+    ("set_preference", "U8", ("deviation","set_preference")),
+    ("skip_ties", "?", ("deviation","skip_ties")),
+    ("seed", "i8", ("execution","seed")),
+]
+
+# scalar election columns (all configurations can be read together)
+ELECTION_COLUMNS = [
+    ("election_index", "i4"), ("converged", "?"), ("cycled", "?"), ("num_deviations", "i4"), ("num_manipulators", "i4"),
+    ("welfare_T", "f8"), ("welfare_F", "f8"),
+    ("jr_candidate_T", "i2"), ("jr_candidate_F", "i2"), ("jr_size_T", "i4"), ("jr_size_F", "i4"),
+    ("ejrplus_candidate_T", "i2"), ("ejrplus_candidate_F", "i2"), ("ejrplus_size_T", "i4"), ("ejrplus_size_F", "i4"),
+    ("ejrplus_l_T", "i2"), ("ejrplus_l_F", "i2"),
+    ("psc_size_T", "i4"), ("psc_size_F", "i4"), ("psc_l_T", "f8"), ("psc_l_F", "f8"),
+    ("ballots_sampled", "i8"),
+]
+
+# defaults for None and fields of the other domain (dichotomous/ordinal)
+DEFAULTS = {"i2": -1, "i4": -1, "i8": -1, "f8": np.nan, "?": False}
+
+DEVIATION_COLUMNS = [("election_index", "i4"), ("step", "i4"), ("voter", "i4")]
+
+
+# HELPER FUNCTIONS
+def num_bytes(size):
+    return max(1,(size+7)//8)
+
+# set or bitmask to little-endian bytes
+def pack(mask, size):
+    if not isinstance(mask, int):
+        mask = to_mask(mask)
+    return np.frombuffer(mask.to_bytes(num_bytes(size),"little"),dtype=np.uint8)
+
+def unpack(row) -> int:
+    return int.from_bytes(np.asarray(row,dtype=np.uint8).tobytes(),"little")
+
+def none_to(value, default):
+    return default if value is None else value
+
+def int_or_none(value):
+    return None if value < 0 else int(value)
+
+def float_or_none(value):
+    return None if np.isnan(value) else float(value)
+
+# equal values, NaN equals NaN
+def same_value(stored, value):
+    return stored == value or (isinstance(value, float) and np.isnan(value) and np.isnan(stored))
+
+# values of the flattened parameters (None as -1, NaN or "")
+def parameter_values(params:Parameters):
+    return {column: none_to(getattr(getattr(params,group),field),DEFAULTS.get(dtype,"")) for column, dtype, (group, field) in PARAMETER_COLUMNS}
+
+# store directory of a configuration (separate directory per shard)
+def store_name(execution:ExecutionParams):
+    return "store" if execution.shard is None else "store_shard_" + str(execution.shard[0]) + "_of_" + str(execution.shard[1])
+
+# election indices run by a shard (contiguous range, all indices without shard)
+def shard_indices(num_elections, shard):
+    if shard is None:
+        return range(num_elections)
+    i, s = shard
+    return range(num_elections*i//s,num_elections*(i+1)//s)
+
+def chunk_dirs(path, table):
+    table_path = os.path.join(path,table)
+    if not os.path.isdir(table_path):
+        return []
+    return [os.path.join(table_path,chunk) for chunk in sorted(os.listdir(table_path)) if chunk.startswith("chunk_")]
+
+
+# WRITING
+# number of the next chunk of a table
+def next_chunk_id(path, table):
+    return max([int(os.path.basename(chunk)[6:]) + 1 for chunk in chunk_dirs(path,table)],default=0)
+
+# remove temporary chunks and deviations without committed elections chunk (interrupted runs)
+def clean_store(store_path):
+    committed = {os.path.basename(chunk) for chunk in chunk_dirs(store_path,"elections")}
+    for table in ["elections","deviations"]:
+        table_path = os.path.join(store_path,table)
+        if not os.path.isdir(table_path):
+            continue
+        for chunk in os.listdir(table_path):
+            if chunk.startswith("tmp_") or (table == "deviations" and chunk not in committed):
+                shutil.rmtree(os.path.join(table_path,chunk))
+
+# buffered writer of one table, each flush writes a new chunk (written to a temporary directory, then renamed)
+# dtypes: dtype of scalar columns (inferred for all other columns), batch_size None: only flushed explicitly
+class TableWriter:
+    def __init__(self, path, table, batch_size=BATCH_SIZE, dtypes={}):
+        self.path = os.path.join(path,table)
+        self.batch_size = batch_size
+        self.dtypes = dtypes
+        self.rows = []
+        os.makedirs(self.path,exist_ok=True)
+        # continue numbering after existing chunks
+        self.next_chunk = next_chunk_id(path,table)
+
+    def add(self, row:dict):
+        self.rows.append(row)
+        if self.batch_size is not None and len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self, chunk_id=None):
+        if self.rows == []:
+            return
+        chunk_id = self.next_chunk if chunk_id is None else chunk_id
+        name = str(chunk_id).zfill(5)
+        tmp = os.path.join(self.path,"tmp_" + name)
+        os.makedirs(tmp)
+        for column in self.rows[0]:
+            np.save(os.path.join(tmp,column + ".npy"),np.array([row[column] for row in self.rows],dtype=self.dtypes.get(column)))
+        os.rename(tmp,os.path.join(self.path,"chunk_" + name))
+        self.next_chunk = chunk_id + 1
+        self.rows = []
+
+# writer of the elections and deviations tables of one configuration
+# checkpointing: both tables are flushed together every batch_size elections or checkpoint_interval seconds,
+# deviations first, the elections chunk with the same number commits them
+# an existing store is continued (resume): unfinished chunks are removed, stored parameters must match
+class ResultWriter:
+    def __init__(self, params:Parameters, batch_size=BATCH_SIZE):
+        self.params = params
+        self.store = store_name(params.execution)
+        self.path = os.path.join(params.filename,self.store)
+        self.batch_size = batch_size
+        self.parameters = parameter_values(params)
+        self.clean()
+        self.elections = TableWriter(self.path,"elections",None,{c: d for c, d, _ in PARAMETER_COLUMNS} | dict(ELECTION_COLUMNS))
+        self.deviations = TableWriter(self.path,"deviations",None,dict(DEVIATION_COLUMNS))
+        self.last_flush = time.time()
+
+    # remove unfinished chunks, check parameters of stored elections
+    def clean(self):
+        clean_store(self.path)
+        stored = read_table(self.params.filename,"elections",[column for column, _, _ in PARAMETER_COLUMNS],store=self.store)
+        for column, value in self.parameters.items():
+            if column in stored and len(stored[column]) > 0 and not same_value(stored[column][0],value):
+                print("\033[91mStored results in " + self.params.filename + " were computed with different parameters (" + column + ")\033[0m")
+                raise ValueError
+
+    # elections already stored (resume)
+    def completed(self) -> list[ElectionData]:
+        return load_elections(self.params.filename,store=self.store)
+
+    def add(self, election_data:ElectionData):
+        n, m = self.params.abcvoting.n, self.params.abcvoting.m
+        x = election_data.iteration_data
+        row = dict(self.parameters)
+        row.update({column: DEFAULTS[dtype] for column, dtype in ELECTION_COLUMNS})
+        row.update({
+            "election_index": election_data.election_index, "converged": x.converged, "cycled": x.cycled,
+            "num_deviations": len(x.all_deviations), "num_manipulators": len(x.manipulators),
+            "ballots_sampled": none_to(election_data.ballots_sampled,-1),
+            "manipulators": pack(x.manipulators,n),
+            "committee_truthful": pack(x.committee_truthful,m), "committee_final": pack(x.committee_final,m),
+            "ballots_truthful": np.stack([pack(A_i,m) for A_i in x.ballots_truthful]),
+        })
+        if self.params.ballot_generation.ordinal:
+            psc = election_data.psc_data
+            row["preferences_truthful"] = np.array(x.preferences_truthful,dtype=np.int16)
+            row.update({"psc_size_T": len(psc.coalition_T), "psc_size_F": len(psc.coalition_F),
+                "psc_l_T": none_to(psc.l_T,np.nan), "psc_l_F": none_to(psc.l_F,np.nan),
+                "psc_coalition_T": pack(psc.coalition_T,n), "psc_coalition_F": pack(psc.coalition_F,n),
+                "psc_cutoff_T": pack(none_to(psc.cutoff_T,0),m), "psc_cutoff_F": pack(none_to(psc.cutoff_F,0),m)})
+        else:
+            jr, ejrplus = election_data.jr_data, election_data.ejrplus_data
+            row.update({"welfare_T": avg_voter_welfare_AV(x.ballots_truthful,x.committee_truthful),
+                "welfare_F": avg_voter_welfare_AV(x.ballots_truthful,x.committee_final),
+                "jr_candidate_T": none_to(jr.candidate_T,-1), "jr_candidate_F": none_to(jr.candidate_F,-1),
+                "jr_size_T": len(jr.unrep_set_T), "jr_size_F": len(jr.unrep_set_F),
+                "jr_unrep_T": pack(jr.unrep_set_T,n), "jr_unrep_F": pack(jr.unrep_set_F,n),
+                "ejrplus_candidate_T": none_to(ejrplus.candidate_T,-1), "ejrplus_candidate_F": none_to(ejrplus.candidate_F,-1),
+                "ejrplus_size_T": len(ejrplus.unrep_set_T), "ejrplus_size_F": len(ejrplus.unrep_set_F),
+                "ejrplus_l_T": none_to(ejrplus.l_T,-1), "ejrplus_l_F": none_to(ejrplus.l_F,-1),
+                "ejrplus_unrep_T": pack(ejrplus.unrep_set_T,n), "ejrplus_unrep_F": pack(ejrplus.unrep_set_F,n)})
+        for step, (voter, ballot, committee) in enumerate(zip(x.all_deviations.voters,x.all_deviations.ballots,x.all_deviations.committees)):
+            self.deviations.add({"election_index": election_data.election_index, "step": step, "voter": voter,
+                "ballot": pack(ballot,m), "committee": pack(committee,m)})
+        self.elections.add(row)
+        if len(self.elections.rows) >= self.batch_size or time.time() - self.last_flush >= self.params.execution.checkpoint_interval:
+            self.flush()
+
+    def flush(self):
+        chunk_id = self.elections.next_chunk
+        self.deviations.flush(chunk_id)
+        self.elections.flush(chunk_id)
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+
+# move the chunks of all shard stores of a configuration directory into its store, returns number of merged elections
+# per chunk: deviations are copied first, renaming the elections chunk commits both (an interrupted merge can be repeated)
+# only merge after all shards have finished
+def merge_shards(path):
+    store_path = os.path.join(path,"store")
+    shards = sorted(d for d in os.listdir(path) if d.startswith("store_shard_")) if os.path.isdir(path) else []
+    merged = 0
+    if shards != []:
+        clean_store(store_path)
+    for shard in shards:
+        shard_path = os.path.join(path,shard)
+        clean_store(shard_path)
+        for chunk in chunk_dirs(shard_path,"elections"):
+            name = os.path.basename(chunk)
+            target = "chunk_" + str(next_chunk_id(store_path,"elections")).zfill(5)
+            os.makedirs(os.path.join(store_path,"elections"),exist_ok=True)
+            os.makedirs(os.path.join(store_path,"deviations"),exist_ok=True)
+            deviations = os.path.join(shard_path,"deviations",name)
+            if os.path.isdir(deviations):
+                tmp = os.path.join(store_path,"deviations","tmp_" + target[6:])
+                shutil.copytree(deviations,tmp)
+                os.rename(tmp,os.path.join(store_path,"deviations",target))
+            merged += len(np.load(os.path.join(chunk,"election_index.npy"),mmap_mode="r"))
+            os.rename(chunk,os.path.join(store_path,"elections",target))
+        shutil.rmtree(shard_path)
+    return merged
+
+# flattened stats of one configuration (None as NaN)
+def stats_values(stats:Stats):
+    values = {}
+    for group in [IterationStats, PSCStats, WelfareStats, JRStats, EJRPlusStats, GenerationStats]:
+        group_stats = next((s for s in stats.__dict__.values() if isinstance(s, group)),None)
+        for field in group.__dataclass_fields__:
+            if not field.startswith("all_"):
+                values[field] = np.nan if group_stats is None else float(getattr(group_stats,field))
+    return values
+
+# write configurations of a sweep (flattened parameters and stats) as one table
+def write_configurations(path, parameters_list, stats_list):
+    # replace table of an earlier (resumed) run
+    shutil.rmtree(os.path.join(path,"store","configurations"),ignore_errors=True)
+    writer = TableWriter(os.path.join(path,"store"),"configurations",len(parameters_list),{c: d for c, d, _ in PARAMETER_COLUMNS})
+    for params, stats in zip(parameters_list,stats_list):
+        row = parameter_values(params)
+        row["filename"] = params.filename
+        row.update(stats_values(stats))
+        writer.add(row)
+    writer.flush()
+
+
+# READING
+# columns of a table (all columns if None), memory-mapped, chunks concatenated
+def read_table(path, table, columns=None, mmap=True, store="store"):
+    chunks = chunk_dirs(os.path.join(path,store),table)
+    if chunks == []:
+        return {}
+    if columns is None:
+        columns = [name[:-4] for name in sorted(os.listdir(chunks[0]))]
+    result = {}
+    for column in columns:
+        arrays = [np.load(os.path.join(chunk,column + ".npy"),mmap_mode="r" if mmap else None) for chunk in chunks]
+        result[column] = arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+    return result
+
+# scalar columns of the elections of all configurations of a sweep
+def read_sweep(data_filename, columns, table="elections"):
+    paths = [os.path.join(data_filename,d) for d in sorted(os.listdir(data_filename)) if os.path.isdir(os.path.join(data_filename,d,"store",table))]
+    tables = [read_table(path,table,columns) for path in paths]
+    tables = [t for t in tables if t != {}]
+    return {column: np.concatenate([t[column] for t in tables]) for column in columns} if tables else {}
+
+
+# RENDERING
+# rebuild election data of all stored elections of a configuration directory (optionally only cycling elections)
+def load_elections(path, only_cycled=False, store="store"):
+    elections = read_table(path,"elections",mmap=False,store=store)
+    if elections == {}:
+        return []
+    deviations = read_table(path,"deviations",mmap=False,store=store)
+    steps = {}
+    for d in range(len(deviations.get("election_index",[]))):
+        steps.setdefault(int(deviations["election_index"][d]),[]).append(d)
+    result = []
+    for row in range(len(elections["election_index"])):
+        if only_cycled and not elections["cycled"][row]:
+            continue
+        ordinal, m = bool(elections["ordinal"][row]), int(elections["m"][row])
+        index = int(elections["election_index"][row])
+        masks = [unpack(A_i) for A_i in elections["ballots_truthful"][row]]
+        # deviations as deltas to the truthful ballots
+        all_deviations = Trajectory(BallotProfile(masks,m))
+        for d in sorted(steps.get(index,[]),key=lambda d: deviations["step"][d]):
+            all_deviations.append(int(deviations["voter"][d]),unpack(deviations["ballot"][d]),unpack(deviations["committee"][d]))
+        voters = lambda column: from_mask(unpack(elections[column][row]))
+        ballots_sampled = int_or_none(elections["ballots_sampled"][row])
+        preferences = elections["preferences_truthful"][row].tolist() if ordinal else None
+        iteration_data = IterationData(bool(elections["converged"][row]),bool(elections["cycled"][row]),preferences,
+            [from_mask(A_i) for A_i in masks],voters("committee_truthful"),voters("committee_final"),voters("manipulators"),all_deviations)
+        if ordinal:
+            # cutoff is None iff there is no violation
+            psc_data = PSCData(voters("psc_coalition_T"),voters("psc_cutoff_T") or None,float_or_none(elections["psc_l_T"][row]),
+                voters("psc_coalition_F"),voters("psc_cutoff_F") or None,float_or_none(elections["psc_l_F"][row]))
+            result.append(ElectionData(index,iteration_data,psc_data,None,None,ballots_sampled))
+        else:
+            jr_data = JRData(int_or_none(elections["jr_candidate_T"][row]),voters("jr_unrep_T"),int_or_none(elections["jr_candidate_F"][row]),voters("jr_unrep_F"))
+            ejrplus_data = EJRPlusData(int_or_none(elections["ejrplus_candidate_T"][row]),voters("ejrplus_unrep_T"),int_or_none(elections["ejrplus_l_T"][row]),
+                int_or_none(elections["ejrplus_candidate_F"][row]),voters("ejrplus_unrep_F"),int_or_none(elections["ejrplus_l_F"][row]))
+            result.append(ElectionData(index,iteration_data,None,jr_data,ejrplus_data,ballots_sampled))
+    return result
+
+# render full log of a configuration directory
+def render_log(path, file=sys.stdout):
+    for election_data in load_elections(path):
+        write_election_log(election_data,election_data.psc_data != None,file)
+
+# render cycling elections of a configuration directory
+def render_cycles(path, file=sys.stdout):
+    for election_data in load_elections(path,only_cycled=True):
+        print("Profile " + str(election_data.election_index),file=file)
+        print_dataclass(election_data.iteration_data,file=file)
+        print("-------------------------------------------------",file=file)
+
+# usage: python result_store.py <configuration directory> [cycles|merge]
+# merge only combines the stored elections of the shards, stats are computed by rerunning the sweep without shard
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[2] == "cycles":
+        render_cycles(sys.argv[1])
+    elif len(sys.argv) > 2 and sys.argv[2] == "merge":
+        print(str(merge_shards(sys.argv[1])) + " elections merged")
+    else:
+        render_log(sys.argv[1])
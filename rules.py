@@ -0,0 +1,317 @@
+# basics
+import math, random, sys
+from itertools import combinations
+
+# IABC
+from bitmasks import candidates, popcount, to_mask
+
+"""
+Native implementations of ABC rules for many tiny repeated computations
+reproduces abcvoting (default algorithms) including lexicographic tie-breaking and resolute/irresolute output
+    - av, sav: separable rules, exact integer scores
+    - seqpav, seqcc: sequential Thiele rules, exact integer marginal scores
+    - seqphragmen, equal-shares, equal-shares-with-av-completion: "float-fractions" algorithm of abcvoting,
+      voters are processed in profile order so that all floating point operations coincide with abcvoting
+ballots are bitmasks in profile order (canonical order when called from compute_committee_memoized)
+returns tuple of committee bitmasks, sorted lexicographically by their candidates
+"""
+
+NATIVE_RULES = ["av","sav","seqpav","seqcc","seqphragmen","equal-shares","equal-shares-with-av-completion"]
+# increase whenever a change alters computed committees (invalidates the persistent store, see persistent_cache.py)
+RULE_VERSION = 1
+
+# tolerances of abcvoting.misc.isclose (used by its float-fractions algorithms)
+FLOAT_ISCLOSE_REL_TOL = 1e-12
+FLOAT_ISCLOSE_ABS_TOL = 1e-12
+
+def isclose(x, y):
+    return math.isclose(x,y,rel_tol=FLOAT_ISCLOSE_REL_TOL,abs_tol=FLOAT_ISCLOSE_ABS_TOL)
+
+# HELPER FUNCTIONS
+# convert collection of committees (iterables of candidates) to sorted tuple of unique bitmasks
+def sorted_committee_masks(committees):
+    return tuple(map(to_mask,sorted({tuple(sorted(W)) for W in committees})))
+
+# aggregate ballots to (ballot, count) pairs of distinct ballots
+def ballot_histogram(ballots):
+    histogram = {}
+    for ballot in ballots:
+        histogram[ballot] = histogram.get(ballot,0) + 1
+    return list(histogram.items())
+
+# voters approving each candidate (ascending voter indices)
+def approvers(m, ballots):
+    return [[v for v in range(len(ballots)) if ballots[v] >> c & 1] for c in range(m)]
+
+# integer marginal weights of sequential Thiele rules (index: number of approved committee members incl. new one)
+# scaled by lcm(1,...,k) to avoid fractions while keeping exact comparisons
+def seq_thiele_weights(abc_rule, k):
+    match abc_rule:
+        case "seqpav":
+            scale = math.lcm(*range(1,k+1))
+            return [0] + [scale//j for j in range(1,k+1)]
+        case "seqcc":
+            return [0,1] + [0]*(k-1)
+    return None
+
+# scale for separable rules: av counts approvals, sav splits lcm(1,...,m) among the approved candidates
+def separable_scale(abc_rule, m):
+    match abc_rule:
+        case "av":
+            return None
+        case "sav":
+            return math.lcm(*range(1,m+1))
+    return None
+
+# score a single ballot contributes to each approved candidate under a separable rule
+def separable_weight(scale, ballot):
+    if scale is None:
+        return 1
+    return scale//popcount(ballot) if ballot else 0
+
+# scores of all candidates under a separable rule
+def separable_scores(abc_rule, m, ballots):
+    scale = separable_scale(abc_rule,m)
+    scores = [0]*m
+    for ballot in ballots:
+        w = separable_weight(scale,ballot)
+        for c in candidates(ballot):
+            scores[c] += w
+    return scores
+
+
+# SEPARABLE RULES (av, sav)
+# winning committees from candidate scores, max_num_of_committees as in abcvoting (None: all)
+def separable_rule(scores, k, resolute, max_num_of_committees=None):
+    cutoff = sorted(scores)[-k]
+    certain = [c for c in range(len(scores)) if scores[c] > cutoff]
+    possible = [c for c in range(len(scores)) if scores[c] == cutoff]
+    missing = k - len(certain)
+    if len(possible) == missing:
+        certain = sorted(certain + possible)
+        possible = []
+        missing = 0
+    if resolute:
+        return [certain + possible[:missing]]
+    committees = []
+    for selection in combinations(possible,missing):
+        committees.append(certain + list(selection))
+        if max_num_of_committees is not None and len(committees) >= max_num_of_committees:
+            break
+    return committees
+
+
+# SEQUENTIAL THIELE RULES (seqpav, seqcc)
+# marginal scores of adding each candidate to committee (bitmask), ballots as (ballot, count) pairs
+def seq_thiele_marginal(weights, m, ballot_counts, committee):
+    scores = [0]*m
+    for ballot, count in ballot_counts:
+        w = weights[popcount(ballot & committee)+1] * count
+        if w == 0:
+            continue
+        for c in candidates(ballot):
+            scores[c] += w
+    return scores
+
+# candidates not in committee with maximal marginal score (ascending)
+def seq_thiele_tied(scores, committee):
+    non_members = [c for c in range(len(scores)) if not committee >> c & 1]
+    best = max(scores[c] for c in non_members)
+    return [c for c in non_members if scores[c] == best]
+
+def seq_thiele(abc_rule, m, k, resolute, ballots):
+    weights = seq_thiele_weights(abc_rule,k)
+    # integer scores: identical ballots can be aggregated
+    ballot_counts = ballot_histogram(ballots)
+    if resolute:
+        committee = 0
+        for _ in range(k):
+            committee |= 1 << seq_thiele_tied(seq_thiele_marginal(weights,m,ballot_counts,committee),committee)[0]
+        return (committee,)
+    # all tie-breaking orders, marginal scores only depend on the set of selected candidates
+    winning_committees, seen, partial_committees = set(), set(), [0]
+    while partial_committees:
+        committee = partial_committees.pop()
+        for c in seq_thiele_tied(seq_thiele_marginal(weights,m,ballot_counts,committee),committee):
+            new_committee = committee | 1 << c
+            if popcount(new_committee) == k:
+                winning_committees.add(new_committee)
+            elif new_committee not in seen:
+                seen.add(new_committee)
+                partial_committees.append(new_committee)
+    return sorted_committee_masks(map(candidates,winning_committees))
+
+
+# SEQUENTIAL PHRAGMEN
+# new maximal loads for adding each candidate (float-fractions algorithm of abcvoting)
+def seqphragmen_maxload(m, k, approvers_c, load, committee):
+    new_maxload = []
+    for c in range(m):
+        if len(approvers_c[c]) > 0:
+            new_maxload.append((sum(load[v] for v in approvers_c[c]) + 1) / len(approvers_c[c]))
+        else:
+            new_maxload.append(k + 1)
+    for c in committee:
+        new_maxload[c] = k + 2
+    return new_maxload
+
+def seqphragmen_resolute(m, k, ballots, start_load=None, partial_committee=None):
+    approvers_c = approvers(m,ballots)
+    load = [0]*len(ballots) if start_load is None else start_load
+    committee = [] if partial_committee is None else partial_committee
+    for _ in range(len(committee),k):
+        new_maxload = seqphragmen_maxload(m,k,approvers_c,load,committee)
+        opt = min(new_maxload)
+        next_c = next(c for c in range(m) if isclose(new_maxload[c],opt))
+        for v in approvers_c[next_c]:
+            load[v] = new_maxload[next_c]
+        committee = sorted(committee + [next_c])
+    return [committee]
+
+def seqphragmen_irresolute(m, k, ballots, start_load=None, partial_committee=None):
+    approvers_c = approvers(m,ballots)
+    load = [0]*len(ballots) if start_load is None else start_load
+    committee_load_pairs = [(() if partial_committee is None else tuple(partial_committee), load)]
+    committees = set()
+    while committee_load_pairs:
+        committee, load = committee_load_pairs.pop()
+        new_maxload = seqphragmen_maxload(m,k,approvers_c,load,committee)
+        opt = min(new_maxload)
+        new_committee_load_pairs = []
+        for c in range(m):
+            if isclose(new_maxload[c],opt):
+                new_load = load[:]
+                for v in approvers_c[c]:
+                    new_load[v] = new_maxload[c]
+                new_committee = committee + (c,)
+                if len(new_committee) == k:
+                    committees.add(tuple(sorted(new_committee)))
+                else:
+                    new_committee_load_pairs.append((new_committee,new_load))
+        committee_load_pairs += reversed(new_committee_load_pairs)
+    return list(committees)
+
+
+# METHOD OF EQUAL SHARES
+# minimal price per approver q such that candidate is affordable, None if not affordable
+# same set operations as abcvoting to reproduce its order of floating point additions
+def equal_shares_min_q(ballots, budget, c):
+    rich = {v for v in range(len(ballots)) if ballots[v] >> c & 1}
+    poor = set()
+    while len(rich) > 0:
+        poor_budget = sum(budget[v] for v in poor)
+        q = (1 - poor_budget) / len(rich)
+        new_poor = {v for v in rich if budget[v] < q and not isclose(budget[v],q)}
+        if len(new_poor) == 0:
+            return q
+        rich -= new_poor
+        poor.update(new_poor)
+    return None
+
+def equal_shares(m, k, resolute, ballots, completion="seqphragmen"):
+    n = len(ballots)
+    max_num_of_committees = 1 if resolute else None
+    committee_budget_pairs = [((), {v: k / n for v in range(n)})]
+    winning_committees = set()
+    while committee_budget_pairs:
+        committee, budget = committee_budget_pairs.pop()
+        min_q = {}
+        for c in range(m):
+            if c in committee:
+                continue
+            q = equal_shares_min_q(ballots,budget,c)
+            if q is not None:
+                min_q[c] = q
+        if len(min_q) > 0:
+            # one or more candidates are affordable
+            tied_cands = [c for c in min_q.keys() if isclose(min_q[c],min(min_q.values()))]
+            new_committee_budget_pairs = []
+            for next_c in sorted(tied_cands):
+                new_budget = dict(budget)
+                for v in range(n):
+                    if ballots[v] >> next_c & 1:
+                        new_budget[v] -= min(budget[v],min_q[next_c])
+                new_committee = committee + (next_c,)
+                if len(new_committee) == k:
+                    winning_committees.add(tuple(sorted(new_committee)))
+                    if max_num_of_committees is not None and len(winning_committees) == max_num_of_committees:
+                        return sorted_committee_masks(winning_committees)
+                else:
+                    new_committee_budget_pairs.append((new_committee,new_budget))
+                if resolute:
+                    break
+            committee_budget_pairs += reversed(new_committee_budget_pairs)
+        elif completion == "seqphragmen":
+            # no affordable candidates remain: complete with seq-Phragmen starting from negative budgets
+            start_load = [-budget[v] / 1 for v in range(n)]
+            if resolute:
+                completed = seqphragmen_resolute(m,k,ballots,start_load,list(committee))
+            else:
+                completed = seqphragmen_irresolute(m,k,ballots,start_load,list(committee))
+            winning_committees.update(tuple(sorted(W)) for W in completed)
+        elif completion == "av":
+            # no affordable candidates remain: complete with the (smallest possible number of) AV winners
+            scores = separable_scores("av",m,ballots)
+            num_missing = k - len(committee)
+            for _ in range(k):
+                new_winning_committees = [set(committee).union(W) for W in separable_rule(scores,num_missing,False,max_num_of_committees)]
+                new_winning_committees = [W for W in new_winning_committees if len(W) == k]
+                if new_winning_committees:
+                    winning_committees.update(tuple(sorted(W)) for W in new_winning_committees)
+                    break
+                num_missing += 1
+        if max_num_of_committees is not None and len(winning_committees) >= max_num_of_committees:
+            break
+    return sorted_committee_masks(winning_committees)
+
+
+# GENERAL RULE COMPUTATION
+# compute all (resolute: one) winning committees of a native rule
+def compute_rule(abc_rule, m, k, resolute, ballots):
+    match abc_rule:
+        case "av" | "sav":
+            return sorted_committee_masks(separable_rule(separable_scores(abc_rule,m,ballots),k,resolute))
+        case "seqpav" | "seqcc":
+            return seq_thiele(abc_rule,m,k,resolute,ballots)
+        case "seqphragmen":
+            if resolute:
+                return sorted_committee_masks(seqphragmen_resolute(m,k,ballots))
+            return sorted_committee_masks(seqphragmen_irresolute(m,k,ballots))
+        case "equal-shares":
+            return equal_shares(m,k,resolute,ballots,"seqphragmen")
+        case "equal-shares-with-av-completion":
+            return equal_shares(m,k,resolute,ballots,"av")
+    print("\033[91mRule not natively implemented: " + str(abc_rule) + "\033[0m")
+    raise ValueError
+
+
+# DIFFERENTIAL CHECK
+# compare native rules with abcvoting on random profiles, returns list of mismatches
+def check_against_abcvoting(num_profiles=1000, max_n=12, max_m=8, seed=0, rules=NATIVE_RULES):
+    from abcvoting.preferences import Profile
+    from abcvoting import abcrules
+    rng = random.Random(seed)
+    mismatches = []
+    for _ in range(num_profiles):
+        m = rng.randint(1,max_m)
+        k = rng.randint(1,m)
+        n = rng.randint(1,max_n)
+        p = rng.choice([0.2,0.4,0.6])
+        # few ballot types to provoke ties
+        ballot_types = [to_mask(c for c in range(m) if rng.random() < p) for _ in range(rng.randint(1,n))]
+        ballots = tuple(sorted(rng.choice(ballot_types) for _ in range(n)))
+        profile = Profile(num_cand=m)
+        profile.add_voters([candidates(A) for A in ballots])
+        for abc_rule in rules:
+            for resolute in [True, False]:
+                expected = tuple(map(to_mask,sorted(map(sorted,abcrules.compute(abc_rule,profile,k,resolute=resolute)))))
+                actual = compute_rule(abc_rule,m,k,resolute,ballots)
+                if expected != actual:
+                    mismatches.append((abc_rule,m,k,resolute,ballots,expected,actual))
+    return mismatches
+
+if __name__ == "__main__":
+    mismatches = check_against_abcvoting(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
+    for mismatch in mismatches:
+        print("\033[91mMismatch: " + str(mismatch) + "\033[0m")
+    print(str(len(mismatches)) + " mismatches")
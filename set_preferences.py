@@ -1,10 +1,23 @@
+# basics
+import random, sys
+import numpy as np
+
 # parameter class datatypes
-from types_classes import Parameters
+from types_classes import ABCVotingParams, BallotGenerationParams, DeviationParams, IterationParams, Parameters
+from bitmasks import approval_matrix, candidates, from_mask, popcount, to_mask
 
 
 """
 Functions for set comparisons using different set preferences
 cmp-functions return True if A is preferred to B
+cmp_committees takes ballots and committees as bitmasks (see bitmasks.py)
+unbeatable-functions return True if no committee of size k is strictly preferred to W (used to stop the deviation search early)
+ordinal comparisons in the deviation search work on rank masks: committee as bitmask over the ranks of a voter
+(bit r set if the candidate ranked r-th is in the committee), rank arrays are computed once per profile (ProfileRanks)
+    - Kelly, Fishburn: comparisons of lowest and highest ranks (lowest/highest set bits)
+    - PD: sorted-rank dominance, at every rank of B, A has at least as many candidates ranked at least as high
+cmp_committees_batch compares many committees to one committee at once (boolean rank matrices)
+the comparisons on preference lists are kept as reference (check_set_preferences)
 """
 
 # DICHOTOMOUS
@@ -13,18 +26,87 @@ cmp-functions return True if A is preferred to B
 def U_AV(ballot:set, W:set) -> int:
     return len(ballot.intersection(W))
 
-def cmp_AV(ballot:set, A:set, B:set) -> bool:
-    return U_AV(ballot,A) > U_AV(ballot,B)
+# bitmask variant: popcount of intersection
+def U_AV_mask(ballot:int, W:int) -> int:
+    return popcount(ballot & W)
+
+def cmp_AV(ballot:int, A:int, B:int) -> bool:
+    return U_AV_mask(ballot,A) > U_AV_mask(ballot,B)
+
+# utility is bounded by the size of the ballot and the committee
+def unbeatable_AV(ballot:int, W:int, k:int) -> bool:
+    return U_AV_mask(ballot,W) == min(k,popcount(ballot))
 
 # CCAV-Utility comparison
 # idea: indicator function whether voter is represented
 def U_CCAV(ballot:set, W:set) -> int:
     return 0 if len(ballot.intersection(W)) == 0 else 1
 
-def cmp_CCAV(ballot:set, A:set, B:set) -> bool:
-    return U_CCAV(ballot,A) > U_CCAV(ballot,B)
+# bitmask variant: non-empty intersection
+def U_CCAV_mask(ballot:int, W:int) -> int:
+    return 0 if ballot & W == 0 else 1
+
+def cmp_CCAV(ballot:int, A:int, B:int) -> bool:
+    return U_CCAV_mask(ballot,A) > U_CCAV_mask(ballot,B)
+
+def unbeatable_CCAV(ballot:int, W:int, k:int) -> bool:
+    return U_CCAV_mask(ballot,W) == min(1,popcount(ballot))
 
 # ORDINAL
+# rank arrays of an ordinal profile: ranks[v][c] rank of candidate c for voter v, orders[v] preference of voter v
+class ProfileRanks:
+    __slots__ = ("orders", "ranks")
+
+    def __init__(self, preferences):
+        self.orders = np.array(preferences,dtype=np.int64).reshape(len(preferences),-1)
+        self.ranks = np.argsort(self.orders,axis=1).tolist()
+
+    # committee W (bitmask) as rank mask of voter v
+    def rank_mask(self, v, W:int) -> int:
+        ranks, R = self.ranks[v], 0
+        for c in candidates(W):
+            R |= 1 << ranks[c]
+        return R
+
+    # committees (bitmasks) as boolean matrix over the ranks of voter v (committees x ranks)
+    def rank_matrix(self, v, Ws, m:int):
+        return approval_matrix(Ws,m)[:,self.orders[v]]
+
+# value of the lowest set bit, value of the highest set bit
+def lowest_bit(R:int) -> int:
+    return R & -R
+
+def highest_bit(R:int) -> int:
+    return 1 << (R.bit_length()-1) if R else 0
+
+# all ranks in X are higher than all ranks in Y (empty sets: True)
+def ranked_above(X:int, Y:int) -> bool:
+    return Y == 0 or X < lowest_bit(Y)
+
+# rank mask variants (A, B as rank masks)
+def cmp_kelly_strict_ranks(A:int, B:int) -> bool:
+    return A != 0 and B != 0 and A < lowest_bit(B) << 1 and lowest_bit(A) < highest_bit(B)
+
+def cmp_fishburn_ranks(A:int, B:int) -> bool:
+    return ranked_above(A & ~B,B) and ranked_above(A,B & ~A)
+
+def cmp_fishburn_strict_ranks(A:int, B:int) -> bool:
+    return cmp_fishburn_ranks(A,B) and not cmp_fishburn_ranks(B,A)
+
+# at the j-th best rank r of B, A has at least j candidates ranked r or higher
+def cmp_PD_ranks(A:int, B:int) -> bool:
+    j = 0
+    while B:
+        j += 1
+        r = lowest_bit(B)
+        if popcount(A & ((r << 1) - 1)) < j:
+            return False
+        B ^= r
+    return True
+
+def cmp_PD_strict_ranks(A:int, B:int) -> bool:
+    return cmp_PD_ranks(A,B) and not cmp_PD_ranks(B,A)
+
 # compare committees according to Kelly's set extension
 def cmp_kelly_strict(preference:list[int], A:set, B:set) -> bool:
     strict = False
@@ -37,6 +119,13 @@ def cmp_kelly_strict(preference:list[int], A:set, B:set) -> bool:
                 strict = True
     return strict
 
+# a committee strictly Kelly-preferred to W consists of k candidates ranked at least as high as the best candidate in W
+# (only sharing that candidate), possible iff its rank r satisfies r >= k-1 (r >= 1 for k=1)
+# W as rank mask
+def unbeatable_kelly(W:int, k:int) -> bool:
+    r = lowest_bit(W).bit_length() - 1
+    return r < max(k-1,1)
+
 # Fishburn comparison
 def cmp_fishburn(preference:list[int], A:set, B:set) -> bool:
     A_minus_B = A-B
@@ -57,6 +146,11 @@ def cmp_fishburn(preference:list[int], A:set, B:set) -> bool:
 def cmp_fishburn_strict(preference:list[int], A:set, B:set) -> bool:
     return cmp_fishburn(preference, A, B) and not cmp_fishburn(preference, B, A)
 
+# W is beaten by replacing its worst candidate with the top candidate, a committee containing the top candidate
+# can only be beaten by committees adding candidates ranked above all of W
+def unbeatable_fishburn(W:int, k:int) -> bool:
+    return W & 1 == 1
+
 # Pairwise dominance comparison
 """
     equivalent to
@@ -77,16 +171,22 @@ def cmp_PD(preference:list[int], A:set, B:set) -> bool:
 def cmp_PD_strict(preference:list[int], A:set, B:set) -> bool:
     return cmp_PD(preference, A, B) and not cmp_PD(preference, B, A)
 
+# the top-k committee pairwise dominates every other committee of size k
+def unbeatable_PD(W:int, k:int) -> bool:
+    return W == (1 << k) - 1
+
 # compare committees using specified comparison function
-def cmp_committees(params:Parameters, preferences_t, ballots_t, i, A, B):
+# ranks_t: ProfileRanks of the truthful preferences (ordinal)
+def cmp_committees(params:Parameters, ranks_t, ballots_t, i, A, B):
     if params.ballot_generation.ordinal:
+        A, B = ranks_t.rank_mask(i,A), ranks_t.rank_mask(i,B)
         match params.deviation.set_preference:
             case "K":
-                is_better = cmp_kelly_strict(preferences_t[i], A, B)
+                is_better = cmp_kelly_strict_ranks(A, B)
             case "F":
-                is_better = cmp_fishburn_strict(preferences_t[i], A, B)
+                is_better = cmp_fishburn_strict_ranks(A, B)
             case "PD":
-                is_better = cmp_PD_strict(preferences_t[i], A, B)
+                is_better = cmp_PD_strict_ranks(A, B)
             case _:
                 print("\033[91mUnknown or incompatible set preference: " + str(params.deviation.set_preference) + "\033[0m")
     else:
@@ -98,4 +198,121 @@ def cmp_committees(params:Parameters, preferences_t, ballots_t, i, A, B):
             case _:
                 print("\033[91mUnknown or incompatible set preference: " + str(params.deviation.set_preference) + "\033[0m")
                 return
-    return is_better
\ No newline at end of file
+    return is_better
+
+# check if committee W (bitmask) cannot be improved upon for voter i using specified set preference
+def is_unbeatable(params:Parameters, ranks_t, ballots_t, i, W):
+    k = params.abcvoting.k
+    match params.deviation.set_preference:
+        case "K":
+            return unbeatable_kelly(ranks_t.rank_mask(i,W),k)
+        case "F":
+            return unbeatable_fishburn(ranks_t.rank_mask(i,W),k)
+        case "PD":
+            return unbeatable_PD(ranks_t.rank_mask(i,W),k)
+        case "AV":
+            return unbeatable_AV(ballots_t[i],W,k)
+        case "CCAV":
+            return unbeatable_CCAV(ballots_t[i],W,k)
+    return False
+
+
+# BATCH COMPARISONS
+# lowest and highest rank of every row of a boolean rank matrix (empty rows: m and -1)
+def lowest_ranks(X):
+    return np.where(X.any(axis=1),X.argmax(axis=1),X.shape[1])
+
+def highest_ranks(X):
+    return np.where(X.any(axis=1),X.shape[1]-1-X[:,::-1].argmax(axis=1),-1)
+
+# rows of X compared to rank vector y (X: committees x ranks, y: ranks)
+def cmp_kelly_strict_batch(X, y):
+    y = y[None,:]
+    return X.any(axis=1) & y.any() & (highest_ranks(X) <= lowest_ranks(y)) & (lowest_ranks(X) < highest_ranks(y))
+
+def cmp_fishburn_batch(X, Y):
+    return (highest_ranks(X & ~Y) < lowest_ranks(Y)) & (highest_ranks(X) < lowest_ranks(Y & ~X))
+
+def cmp_fishburn_strict_batch(X, y):
+    Y = np.broadcast_to(y,X.shape)
+    return cmp_fishburn_batch(X,Y) & ~cmp_fishburn_batch(Y,X)
+
+# prefix counts over ranks dominate
+def cmp_PD_batch(X, Y):
+    return (np.cumsum(X,axis=1) >= np.cumsum(Y,axis=1)).all(axis=1)
+
+def cmp_PD_strict_batch(X, y):
+    Y = np.broadcast_to(y,X.shape)
+    return cmp_PD_batch(X,Y) & ~cmp_PD_batch(Y,X)
+
+# compare committees As (bitmasks) to committee B using specified comparison function, boolean array
+def cmp_committees_batch(params:Parameters, ranks_t, ballots_t, i, As, B):
+    m = params.abcvoting.m
+    if params.ballot_generation.ordinal:
+        X, y = ranks_t.rank_matrix(i,As,m), ranks_t.rank_matrix(i,[B],m)[0]
+        match params.deviation.set_preference:
+            case "K":
+                return cmp_kelly_strict_batch(X,y)
+            case "F":
+                return cmp_fishburn_strict_batch(X,y)
+            case "PD":
+                return cmp_PD_strict_batch(X,y)
+    else:
+        # utility of every committee: approved candidates in the committee (AV) or at least one (CCAV)
+        X = approval_matrix(As,m)[:,approval_matrix([ballots_t[i]],m)[0]].sum(axis=1)
+        y = popcount(ballots_t[i] & B)
+        match params.deviation.set_preference:
+            case "AV":
+                return X > y
+            case "CCAV":
+                return np.minimum(X,1) > min(y,1)
+    print("\033[91mUnknown or incompatible set preference: " + str(params.deviation.set_preference) + "\033[0m")
+    raise ValueError
+
+
+# VERIFICATION
+# compare rank-based (scalar and batch) ordinal comparisons and unbeatable conditions to the comparisons on preference lists,
+# dichotomous batch comparisons to the scalar comparisons
+# returns list of mismatches (set preference, preference or ballot, A, B, expected, actual)
+def check_set_preferences(num_tests=20000, max_m=8, seed=0):
+    rng = random.Random(seed)
+    references = {"K": cmp_kelly_strict, "F": cmp_fishburn_strict, "PD": cmp_PD_strict}
+    mismatches = []
+    for _ in range(num_tests):
+        m = rng.randint(1,max_m)
+        preference = rng.sample(range(m),m)
+        ranks = ProfileRanks([preference])
+        # committees of equal and of different sizes (including empty committees)
+        A = to_mask(c for c in range(m) if rng.random() < 0.5)
+        Bs = [to_mask(c for c in range(m) if rng.random() < 0.5) for _ in range(8)]
+        for set_preference, reference in references.items():
+            expected = [reference(preference,from_mask(B),from_mask(A)) for B in Bs]
+            scalar = [{"K": cmp_kelly_strict_ranks, "F": cmp_fishburn_strict_ranks, "PD": cmp_PD_strict_ranks}[set_preference](ranks.rank_mask(0,B),ranks.rank_mask(0,A)) for B in Bs]
+            X, y = ranks.rank_matrix(0,Bs,m), ranks.rank_matrix(0,[A],m)[0]
+            batch = {"K": cmp_kelly_strict_batch, "F": cmp_fishburn_strict_batch, "PD": cmp_PD_strict_batch}[set_preference](X,y).tolist()
+            if expected != scalar or expected != batch:
+                mismatches.append((set_preference,preference,A,Bs,expected,(scalar,batch)))
+        ballot = to_mask(c for c in range(m) if rng.random() < 0.5)
+        for set_preference, cmp in [("AV",cmp_AV),("CCAV",cmp_CCAV)]:
+            params = Parameters(1,BallotGenerationParams(True,False,"manual",1,None,None,None,None,None,None),ABCVotingParams("av",1,m,1,False),
+                IterationParams(1,True),DeviationParams("brute_force",None,set_preference,False),False,"")
+            expected = [cmp(ballot,B,A) for B in Bs]
+            batch = cmp_committees_batch(params,None,[ballot],0,Bs,A).tolist()
+            if expected != batch:
+                mismatches.append((set_preference,ballot,A,Bs,expected,batch))
+        # unbeatable: no committee of size k strictly preferred (exhaustive)
+        k = popcount(A)
+        if k > 0:
+            W = ranks.rank_mask(0,A)
+            committees = [B for B in range(2**m) if popcount(B) == k]
+            for set_preference, unbeatable in [("K",unbeatable_kelly),("F",unbeatable_fishburn),("PD",unbeatable_PD)]:
+                expected = not any(references[set_preference](preference,from_mask(B),from_mask(A)) for B in committees)
+                if unbeatable(W,k) != expected:
+                    mismatches.append((set_preference + " unbeatable",preference,A,k,expected,not expected))
+    return mismatches
+
+if __name__ == "__main__":
+    mismatches = check_set_preferences(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
+    for mismatch in mismatches:
+        print("\033[91mMismatch: " + str(mismatch) + "\033[0m")
+    print(str(len(mismatches)) + " mismatches")
@@ -0,0 +1,149 @@
+# basics
+import hashlib
+import numpy as np
+
+# parallelisation
+from multiprocessing import RawArray, Value
+
+"""
+Committee cache shared between the workers of a multiprocessing Pool (L2 behind the per-process lru_cache)
+open addressing hash table in shared memory, one slot per entry:
+    [fingerprint_hi, fingerprint_lo, committee bitmask, meta]
+    meta: bit 0 occupied, bit 1 tied, bit 2 no committee (None), bits 3-63 checksum of the other words
+keys are 128-bit fingerprints of (abc_rule, m, k, resolute, canonical ballots)
+reads and writes are lock-free: writers invalidate meta first and write it last,
+readers drop entries whose checksum does not match (concurrently written slots count as misses)
+only committees of up to 64 candidates fit into a slot, larger instances bypass the shared cache
+"""
+
+SLOT_WORDS = 4
+MAX_PROBES = 8
+MAX_WORKERS = 256
+MASK_64 = (1 << 64) - 1
+
+# counters per worker: calls to compute_committee, L1 misses answered by L2, L1 and L2 misses (computed or read from disk)
+COUNTERS = ["calls", "l2_hits", "misses"]
+
+# shared cache of the current process (set in pool workers by attach)
+active = None
+# counters of the current process, written to the shared counter slot of the worker by flush_counters
+local_counters = dict.fromkeys(COUNTERS,0)
+
+
+# HELPER FUNCTIONS
+# 128-bit fingerprint of a cache key
+def fingerprint(key):
+    digest = hashlib.blake2b(repr(key).encode(),digest_size=16).digest()
+    return int.from_bytes(digest[:8],"little"), int.from_bytes(digest[8:],"little")
+
+# checksum of slot contents, stored in the upper bits of meta
+def checksum(hi, lo, value):
+    return ((hi * 0x9E3779B97F4A7C15) ^ (lo * 0xC2B2AE3D27D4EB4F) ^ (value * 0x165667B19E3779F9)) & MASK_64 & ~7
+
+
+# SHARED CACHE
+class SharedCommitteeCache:
+    # allocate table with num_slots entries in shared memory (before the pool is created)
+    def __init__(self, num_slots):
+        self.num_slots = num_slots
+        self.table_raw = RawArray("Q",num_slots*SLOT_WORDS)
+        self.counters_raw = RawArray("q",MAX_WORKERS*len(COUNTERS))
+        self.next_worker = Value("i",0)
+        self.attach_arrays()
+
+    def attach_arrays(self):
+        self.table = np.frombuffer(self.table_raw,dtype=np.uint64).reshape(-1,SLOT_WORDS)
+        self.counters = np.frombuffer(self.counters_raw,dtype=np.int64).reshape(-1,len(COUNTERS))
+
+    # numpy views are not pickled, only the shared arrays
+    def __getstate__(self):
+        return {"num_slots": self.num_slots, "table_raw": self.table_raw, "counters_raw": self.counters_raw, "next_worker": self.next_worker}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.attach_arrays()
+
+    # returns (W, tied) or None if key is not cached
+    def lookup(self, key):
+        hi, lo = fingerprint(key)
+        start = lo % self.num_slots
+        for probe in range(MAX_PROBES):
+            slot = self.table[(start + probe) % self.num_slots]
+            meta = int(slot[3])
+            if meta == 0:
+                return None
+            if int(slot[0]) == hi and int(slot[1]) == lo:
+                value = int(slot[2])
+                if meta & ~7 != checksum(hi,lo,value):
+                    return None
+                return (None if meta & 4 else value), bool(meta & 2)
+        return None
+
+    # store (W, tied) for key, overwrites the first probed slot if all probed slots are in use
+    def store(self, key, result):
+        W, tied = result
+        if W is not None and W > MASK_64:
+            return
+        hi, lo = fingerprint(key)
+        value = 0 if W is None else W
+        start = lo % self.num_slots
+        index = start
+        for probe in range(MAX_PROBES):
+            slot = self.table[(start + probe) % self.num_slots]
+            if int(slot[3]) == 0 or (int(slot[0]) == hi and int(slot[1]) == lo):
+                index = (start + probe) % self.num_slots
+                break
+        meta = checksum(hi,lo,value) | 1 | (2 if tied else 0) | (4 if W is None else 0)
+        slot = self.table[index]
+        slot[3] = 0
+        slot[0], slot[1], slot[2] = hi, lo, value
+        slot[3] = meta
+
+    # assign a counter slot to the calling worker
+    def register_worker(self):
+        with self.next_worker.get_lock():
+            worker = self.next_worker.value
+            self.next_worker.value += 1
+        return worker % MAX_WORKERS
+
+    # total counters of all workers
+    def stats(self):
+        totals = dict(zip(COUNTERS,map(int,self.counters.sum(axis=0))))
+        totals["l1_hits"] = totals["calls"] - totals["l2_hits"] - totals["misses"]
+        return totals
+
+    def report(self):
+        stats = self.stats()
+        return "Shared committee cache: " + str(stats["calls"]) + " lookups, " + str(stats["l1_hits"]) + " L1 hits, " + str(stats["l2_hits"]) + " L2 hits, " + str(stats["misses"]) + " misses"
+
+
+# WORKER SIDE
+worker_slot = None
+
+# pool initializer: use shared cache in this worker
+def attach(cache):
+    global active, worker_slot
+    active = cache
+    if cache is not None:
+        worker_slot = cache.register_worker()
+
+# add counters of this worker to its shared counter slot and reset them
+def flush_counters():
+    if active is not None:
+        active.counters[worker_slot] += [local_counters[c] for c in COUNTERS]
+        for c in COUNTERS:
+            local_counters[c] = 0
+
+# L2 lookup, None if no shared cache is attached or key is not cached
+def lookup(key):
+    if active is None:
+        return None
+    result = active.lookup(key)
+    if result is not None:
+        local_counters["l2_hits"] += 1
+    return result
+
+def store(key, result):
+    local_counters["misses"] += 1
+    if active is not None:
+        active.store(key,result)
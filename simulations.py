@@ -1,17 +1,15 @@
 import os, random
-from iterations import run_profiles
+from iterations import run_sweep
 from parameters import set_params
 from types_classes import *
 
 # data storage
-import pandas as pd
+from result_store import write_configurations
 
 # manual approval preferences for ejr+ violations in seqphragmen and seqpav
 seqphragmen_ejrplus_vio = [{0,1,2}]*2 + [{0,1,3}]*2 + [{2,3,4,5,6,7,8,9,10,11,12,13}]*6 + [{3,4,5,6,7,8,9,10,11,12,13}]*5 + [{4,5,6,7,8,9,10,11,12,13}]*9
-random.shuffle(seqphragmen_ejrplus_vio)
 
 seqpav_ejrplus_vio = [{0,1,2,3,4},{0,1,2,3,5}] + [{0,1,3,4}]*9 + [{0,1,3,5}]*8 + [{0,2,4}]*8 + [{0,2,5}]*10 + [{0,3,5}] + [{1,2,3}]*4 + [{1,2,5}]*5 + [{1,4}]*7 + [{1,5}]*2 + [{2,3}]*4 + [{2,4}]*3 + [{2,5}] + [{3}]*9 + [{4}]*8 + [{5}]*9 + [{6}]*18
-random.shuffle(seqpav_ejrplus_vio)
 
 ## SET FIXED PARAMETERS
 # variable parameters will overwrite fixed ones
@@ -46,73 +44,77 @@ deviation_type      = "swap_j"
 swap_j              = 1
 set_preference      = "AV"
 skip_ties           = False
+# restrict deviations to ballots of best-response oracles where available (brute_force, subset; see oracles.py)
+best_response_oracle = False
 trace               = False
 
+# EXECUTION
+# SQLite file reusing computed committees across runs (None: disabled)
+committee_store     = None
+# keep data of single elections in memory (stats.all_*_data), log is written while elections finish
+keep_election_data  = True
+# master seed of the per-election random streams, reproducible runs (None: unseeded)
+seed                = None
+# run only a part of each configuration: (shard, number of shards), e.g. one shard per machine on shared storage
+# rerun with shard = None after all shards have finished to merge the shards and write the stats (see run_sweep)
+shard               = None
+
+# shuffle manual preferences (identical on all shards if seeded)
+random.Random(seed).shuffle(seqphragmen_ejrplus_vio)
+random.Random(seed).shuffle(seqpav_ejrplus_vio)
+
 krange = [2,4,6,8]
 mrange = [6,8,10,12,14]
 nrange = [2,4,8,12,16,20]
 
 ## RUN BATCHES FOR SIMULATIONS
+# run all configurations in one worker pool, write output of each configuration as soon as it is finished
+# logs can be rendered from the result store of each configuration (python result_store.py <directory>)
+# restarting a sweep with the same data_filename resumes it (finished elections are read from the result stores)
+def run_configurations(data_filename, parameters_list):
+    stats_list = [None]*len(parameters_list)
+    def on_finished(c, parameters, stats):
+        with open(parameters.filename + "/params_stats.txt", "w") as f:
+            print("Parameters:",file=f)
+            print_dataclass(parameters,file=f)
+            print("-------------------------------------------------",file=f)
+            print("Stats:",file=f)
+            print_dataclass(stats,file=f)
+        # save stats for dataframe
+        stats_list[c] = stats
+    run_sweep(parameters_list,on_finished)
+    # stats are written by the merging run
+    if shard is not None:
+        return
+    # store flattened parameters and stats of all configurations (columnar, see result_store.py)
+    write_configurations(data_filename,parameters_list,stats_list)
+
 def plot_elections_rules(data_filename):
-    # initialise lists for dataframe
-    parameters_list, stats_list = [], []
+    # initialise list of configurations
+    parameters_list = []
     # set file output path
-    os.mkdir(data_filename)
+    os.makedirs(data_filename,exist_ok=True)
     #["av","cc", "seqcc", "pav", "seqpav", "sav", "equal-shares", "equal-shares-with-av-completion", "seqphragmen"]
     for abc_rule in ["seqcc", "seqpav", "sav", "equal-shares", "seqphragmen"]:
         for max_iterations in [20,40,60,80,100]:
             for cycle_iteration in [True, False]:
                 filename = data_filename + "/" + str(abc_rule) + "_" + str(max_iterations) + "_" + str(cycle_iteration)
-                os.mkdir(filename)
-                parameters = set_params(num_elections,skip_empty_ballots,ordinal,culture,avg_ballot_size,alpha,phi,manual_ballots,manual_preference,random_cutoff,cutoff_points,abc_rule,n,m,k,resolute,max_iterations,cycle_iteration,deviation_type,swap_j,set_preference,skip_ties,trace,filename)
-                stats = run_profiles(parameters)
-                with open(parameters.filename + "/params_stats.txt", "a") as f:
-                    print("Parameters:",file=f)
-                    print_dataclass(parameters,file=f)
-                    print("-------------------------------------------------",file=f)
-                    print("Stats:",file=f)
-                    print_dataclass(stats,file=f)
-                write_log(stats,parameters)
-                # save parameters and stats for dataframe
-                parameters_list.append(parameters)
-                stats_list.append(stats)
-    # store to dataframe
-    df = pd.DataFrame({
-        "parameters": parameters_list,
-        "stats": stats_list
-    })
-    # store dataframe to file
-    df.to_pickle(data_filename+"/params_stats.pkl")
+                os.makedirs(filename,exist_ok=True)
+                parameters_list.append(set_params(num_elections,skip_empty_ballots,ordinal,culture,avg_ballot_size,alpha,phi,manual_ballots,manual_preference,random_cutoff,cutoff_points,abc_rule,n,m,k,resolute,max_iterations,cycle_iteration,deviation_type,swap_j,set_preference,skip_ties,trace,filename,best_response_oracle=best_response_oracle,committee_store=committee_store,keep_election_data=keep_election_data,seed=seed,shard=shard))
+    run_configurations(data_filename,parameters_list)
     return
 
 def plot_elections_two_params(data_filename):
-    # initialise lists for dataframe
-    parameters_list, stats_list = [], []
+    # initialise list of configurations
+    parameters_list = []
     # set file output path
-    os.mkdir(data_filename)
+    os.makedirs(data_filename,exist_ok=True)
     for n in [2,4,8,12,16]:
         for m in [10,20,30,40,50]:
             filename = data_filename + "/" + str(n) + "_" + str(m)
-            os.mkdir(filename)
-            parameters = set_params(num_elections,skip_empty_ballots,ordinal,culture,avg_ballot_size,alpha,phi,manual_ballots,manual_preference,random_cutoff,cutoff_points,abc_rule,n,m,k,resolute,max_iterations,cycle_iteration,deviation_type,swap_j,set_preference,skip_ties,trace,filename)
-            stats = run_profiles(parameters)
-            with open(parameters.filename + "/params_stats.txt", "a") as f:
-                print("Parameters:",file=f)
-                print_dataclass(parameters,file=f)
-                print("-------------------------------------------------",file=f)
-                print("Stats:",file=f)
-                print_dataclass(stats,file=f)
-            write_log(stats,parameters)
-            # save parameters and stats for dataframe
-            parameters_list.append(parameters)
-            stats_list.append(stats)
-    # store to dataframe
-    df = pd.DataFrame({
-        "parameters": parameters_list,
-        "stats": stats_list
-    })
-    # store dataframe to file
-    df.to_pickle(data_filename+"/params_stats.pkl")
+            os.makedirs(filename,exist_ok=True)
+            parameters_list.append(set_params(num_elections,skip_empty_ballots,ordinal,culture,avg_ballot_size,alpha,phi,manual_ballots,manual_preference,random_cutoff,cutoff_points,abc_rule,n,m,k,resolute,max_iterations,cycle_iteration,deviation_type,swap_j,set_preference,skip_ties,trace,filename,best_response_oracle=best_response_oracle,committee_store=committee_store,keep_election_data=keep_election_data,seed=seed,shard=shard))
+    run_configurations(data_filename,parameters_list)
     return
 
 data_filename = ""
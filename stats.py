@@ -1,112 +1,203 @@
+from fractions import Fraction
+
 from types_classes import *
 from set_preferences import U_AV
 
 # CALCULATE STATS
-# calculate stats for batch from list of data from single elections
+# calculate stats for batch from data of single elections
+# streaming: accumulators are fed one election at a time (in the order results arrive), the data of single elections
+# is only kept (all_*_data) if requested
+# stats do not depend on the order of arrival (exact welfare sums, kept data sorted by election index),
+# so resumed and sharded runs give the same stats as a single run
 
 # HELPER FUNCTIONS
-# calculate number of elements in list that satisfy predicate P
-def count_if(P, l):
-    return len(list(filter(P, l)))
-
 # calculate sum of function f over list
 def sum_f(f, l):
     if l == []: return 0
     return sum([f(x) for x in l])
 
-# calculate PSC stats from list of data from single elections
-def get_psc_stats(psc_data_list: list[PSCData]):
-    num_elections = len(psc_data_list)
-    num_violations_T = count_if(lambda x: x.coalition_T != set(),psc_data_list)
-    num_violations_F = count_if(lambda x: x.coalition_F != set(),psc_data_list)
-    
-    percent_psc_violations_T = num_violations_T / num_elections * 100
-    percent_psc_violations_F = num_violations_F / num_elections * 100
-    avg_size_psc_violations_T = sum_f(lambda x: len(x.coalition_T),psc_data_list) / (max(1,num_violations_T))
-    avg_size_psc_violations_F = sum_f(lambda x: len(x.coalition_F),psc_data_list) / (max(1,num_violations_F))
-    return PSCStats(percent_psc_violations_T,percent_psc_violations_F,avg_size_psc_violations_T,avg_size_psc_violations_F,psc_data_list)
-
-# calculate EJR+ stats from list of data from single elections
-def get_ejrplus_stats(ejrplus_data_list: list[EJRPlusData]):
-    num_elections = len(ejrplus_data_list)
-    num_violations_T = count_if(lambda x: x.candidate_T != None,ejrplus_data_list)
-    num_violations_F = count_if(lambda x: x.candidate_F != None,ejrplus_data_list)
-
-    percent_ejrplus_violations_T = num_violations_T / num_elections * 100
-    percent_ejrplus_violations_F = num_violations_F / num_elections * 100
-    avg_size_ejrplus_violations_T = sum_f(lambda x: len(x.unrep_set_T),ejrplus_data_list) / (max(1,num_violations_T))
-    avg_size_ejrplus_violations_F = sum_f(lambda x: len(x.unrep_set_F),ejrplus_data_list) / (max(1,num_violations_F))
-    return EJRPlusStats(percent_ejrplus_violations_T,percent_ejrplus_violations_F,avg_size_ejrplus_violations_T,avg_size_ejrplus_violations_F,ejrplus_data_list)
-
-# calculate JR stats from list of data from single elections
-def get_jr_stats(jr_data_list: list[JRData]):
-    num_elections = len(jr_data_list)
-    num_violations_T = count_if(lambda x: x.candidate_T != None,jr_data_list)
-    num_violations_F = count_if(lambda x: x.candidate_F != None,jr_data_list)
-
-    percent_jr_violations_T = num_violations_T / num_elections * 100
-    percent_jr_violations_F = num_violations_F / num_elections * 100
-    avg_size_jr_violations_T = sum_f(lambda x: len(x.unrep_set_T),jr_data_list) / (max(1,num_violations_T))
-    avg_size_jr_violations_F = sum_f(lambda x: len(x.unrep_set_F),jr_data_list) / (max(1,num_violations_F))
-    return JRStats(percent_jr_violations_T,percent_jr_violations_F,avg_size_jr_violations_T,avg_size_jr_violations_F,jr_data_list)
-
-# calculate iteration stats from list of data from single elections
-def get_iteration_stats(iteration_data_list: list[IterationData]):
-    # helper calculations
-    ordinal = iteration_data_list[0].preferences_truthful != None
-    num_elections = len(iteration_data_list)
-    num_converging = count_if(lambda x: x.converged,iteration_data_list)
-    num_cycling = count_if(lambda x: x.cycled,iteration_data_list)
-    num_deviating = count_if(lambda x: len(x.all_deviations) > 0,iteration_data_list)
-
-    # calculate stats for output
-    percent_converging = num_converging / num_elections * 100
-    percent_cycling = num_cycling / num_elections * 100
-    percent_deviating = num_deviating / num_elections * 100
-    avg_num_deviations = sum_f(lambda x: len(x.all_deviations),iteration_data_list) / num_elections
-    avg_num_manipulators = sum_f(lambda x: len(x.manipulators),iteration_data_list) / num_elections
-    return IterationStats(percent_converging,percent_cycling,percent_deviating,avg_num_deviations,avg_num_manipulators,iteration_data_list)
-
-
 # calculate average welfare per voter for given committee using AV utility
 def avg_voter_welfare_AV(approval_sets,committee):
     return sum_f(lambda A_i:U_AV(A_i,committee),approval_sets)/len(approval_sets)
 
-# calculate welfare stats from list of data from single elections using AV utility, only for dichotomous setting
-def get_welfare_stats(n,iteration_data_list: list[IterationData]):
-    # helper calculations
-    all_voters = set(range(n))
-    num_elections = len(iteration_data_list)
-    iteration_data_list_deviations = [x for x in iteration_data_list if x.manipulators != set()]
-    num_elections_deviations = max(1,len(iteration_data_list_deviations))
-
-    # calculate average overall welfare
-    avg_welfare_T = sum_f(lambda x: avg_voter_welfare_AV(x.ballots_truthful,x.committee_truthful),iteration_data_list) / num_elections
-    avg_welfare_F = sum_f(lambda x: avg_voter_welfare_AV(x.ballots_truthful,x.committee_final),iteration_data_list) / num_elections
-
-    # calculate average welfare in elections with deviations
-    avg_welfare_T_if_deviations = sum_f(lambda x: avg_voter_welfare_AV(x.ballots_truthful,x.committee_truthful),iteration_data_list_deviations) / num_elections_deviations
-    avg_welfare_F_if_deviations = sum_f(lambda x: avg_voter_welfare_AV(x.ballots_truthful,x.committee_final),iteration_data_list_deviations) / num_elections_deviations
-    
-    # calculate average welfare of manipulators in elections with deviations
-    avg_welfare_manipulators_T = sum_f(lambda x: avg_voter_welfare_AV([x.ballots_truthful[i] for i in x.manipulators],x.committee_truthful),iteration_data_list_deviations) / num_elections_deviations
-    avg_welfare_manipulators_F = sum_f(lambda x: avg_voter_welfare_AV([x.ballots_truthful[i] for i in x.manipulators],x.committee_final),iteration_data_list_deviations) / num_elections_deviations
-
-    # calculate average welfare of non-manipulators in elections with deviations
-    # cannot handle non-manipulators of size 0 (cases where all voters are manipulators)
-    # avg_welfare_non_manipulators_T = sum_f(lambda x: avg_voter_welfare_AV([x.ballots_truthful[i] for i in all_voters - x.manipulators],x.committee_truthful),iteration_data_list_deviations) / num_elections_deviations
-    #avg_welfare_non_manipulators_F = sum_f(lambda x: avg_voter_welfare_AV([x.ballots_truthful[i] for i in all_voters - x.manipulators],x.committee_final),iteration_data_list_deviations) / num_elections_deviations
-
-    return WelfareStats(avg_welfare_T,avg_welfare_F,avg_welfare_T_if_deviations,avg_welfare_F_if_deviations,avg_welfare_manipulators_T,avg_welfare_manipulators_F)
-
-# calculate all availablestats from list of data from single elections, depending on domain
+
+# ACCUMULATORS
+# PSC stats
+class PSCAccumulator:
+    def __init__(self, keep_data):
+        self.num_elections = 0
+        self.num_violations_T, self.num_violations_F = 0, 0
+        self.size_violations_T, self.size_violations_F = 0, 0
+        self.all_data = [] if keep_data else None
+
+    def add(self, x: PSCData):
+        self.num_elections += 1
+        self.num_violations_T += x.coalition_T != set()
+        self.num_violations_F += x.coalition_F != set()
+        self.size_violations_T += len(x.coalition_T)
+        self.size_violations_F += len(x.coalition_F)
+        if self.all_data is not None:
+            self.all_data.append(x)
+
+    def result(self):
+        percent_psc_violations_T = self.num_violations_T / self.num_elections * 100
+        percent_psc_violations_F = self.num_violations_F / self.num_elections * 100
+        avg_size_psc_violations_T = self.size_violations_T / (max(1,self.num_violations_T))
+        avg_size_psc_violations_F = self.size_violations_F / (max(1,self.num_violations_F))
+        return PSCStats(percent_psc_violations_T,percent_psc_violations_F,avg_size_psc_violations_T,avg_size_psc_violations_F,self.all_data)
+
+# JR and EJR+ stats (same structure: violating candidate and unrepresented set before and after deviations)
+class RepresentationAccumulator:
+    def __init__(self, stats_class, keep_data):
+        self.stats_class = stats_class
+        self.num_elections = 0
+        self.num_violations_T, self.num_violations_F = 0, 0
+        self.size_violations_T, self.size_violations_F = 0, 0
+        self.all_data = [] if keep_data else None
+
+    def add(self, x: JRData|EJRPlusData):
+        self.num_elections += 1
+        self.num_violations_T += x.candidate_T != None
+        self.num_violations_F += x.candidate_F != None
+        self.size_violations_T += len(x.unrep_set_T)
+        self.size_violations_F += len(x.unrep_set_F)
+        if self.all_data is not None:
+            self.all_data.append(x)
+
+    def result(self):
+        percent_violations_T = self.num_violations_T / self.num_elections * 100
+        percent_violations_F = self.num_violations_F / self.num_elections * 100
+        avg_size_violations_T = self.size_violations_T / (max(1,self.num_violations_T))
+        avg_size_violations_F = self.size_violations_F / (max(1,self.num_violations_F))
+        return self.stats_class(percent_violations_T,percent_violations_F,avg_size_violations_T,avg_size_violations_F,self.all_data)
+
+# iteration stats
+class IterationAccumulator:
+    def __init__(self, keep_data):
+        self.num_elections = 0
+        self.num_converging, self.num_cycling, self.num_deviating = 0, 0, 0
+        self.num_deviations, self.num_manipulators = 0, 0
+        self.all_data = [] if keep_data else None
+
+    def add(self, x: IterationData):
+        self.num_elections += 1
+        self.num_converging += x.converged
+        self.num_cycling += x.cycled
+        self.num_deviating += len(x.all_deviations) > 0
+        self.num_deviations += len(x.all_deviations)
+        self.num_manipulators += len(x.manipulators)
+        if self.all_data is not None:
+            self.all_data.append(x)
+
+    def result(self):
+        percent_converging = self.num_converging / self.num_elections * 100
+        percent_cycling = self.num_cycling / self.num_elections * 100
+        percent_deviating = self.num_deviating / self.num_elections * 100
+        avg_num_deviations = self.num_deviations / self.num_elections
+        avg_num_manipulators = self.num_manipulators / self.num_elections
+        return IterationStats(percent_converging,percent_cycling,percent_deviating,avg_num_deviations,avg_num_manipulators,self.all_data)
+
+# average welfare per voter as exact fraction (summed without rounding)
+def avg_voter_welfare_AV_exact(approval_sets,committee):
+    return Fraction(sum_f(lambda A_i:U_AV(A_i,committee),approval_sets),len(approval_sets))
+
+# welfare stats using AV utility, only for dichotomous setting
+class WelfareAccumulator:
+    def __init__(self):
+        self.num_elections, self.num_elections_deviations = 0, 0
+        # overall welfare, welfare in elections with deviations, welfare of manipulators in elections with deviations
+        self.welfare_T, self.welfare_F = 0, 0
+        self.welfare_dev_T, self.welfare_dev_F = 0, 0
+        self.welfare_manip_T, self.welfare_manip_F = 0, 0
+
+    def add(self, x: IterationData):
+        self.num_elections += 1
+        welfare_T = avg_voter_welfare_AV_exact(x.ballots_truthful,x.committee_truthful)
+        welfare_F = avg_voter_welfare_AV_exact(x.ballots_truthful,x.committee_final)
+        self.welfare_T += welfare_T
+        self.welfare_F += welfare_F
+        if x.manipulators != set():
+            self.num_elections_deviations += 1
+            self.welfare_dev_T += welfare_T
+            self.welfare_dev_F += welfare_F
+            self.welfare_manip_T += avg_voter_welfare_AV_exact([x.ballots_truthful[i] for i in x.manipulators],x.committee_truthful)
+            self.welfare_manip_F += avg_voter_welfare_AV_exact([x.ballots_truthful[i] for i in x.manipulators],x.committee_final)
+
+    def result(self):
+        num_elections_deviations = max(1,self.num_elections_deviations)
+        avg_welfare_T = float(self.welfare_T / self.num_elections)
+        avg_welfare_F = float(self.welfare_F / self.num_elections)
+        avg_welfare_T_if_deviations = float(self.welfare_dev_T / num_elections_deviations)
+        avg_welfare_F_if_deviations = float(self.welfare_dev_F / num_elections_deviations)
+        avg_welfare_manipulators_T = float(self.welfare_manip_T / num_elections_deviations)
+        avg_welfare_manipulators_F = float(self.welfare_manip_F / num_elections_deviations)
+        # welfare of non-manipulators not computed (undefined if all voters are manipulators)
+        return WelfareStats(avg_welfare_T,avg_welfare_F,avg_welfare_T_if_deviations,avg_welfare_F_if_deviations,avg_welfare_manipulators_T,avg_welfare_manipulators_F)
+
+# acceptance of sampled ballots, only elections with generated profiles
+class GenerationAccumulator:
+    def __init__(self):
+        self.num_elections = 0
+        self.ballots_sampled, self.ballots_accepted = 0, 0
+
+    def add(self, x: ElectionData):
+        if x.ballots_sampled is None:
+            return
+        self.num_elections += 1
+        self.ballots_sampled += x.ballots_sampled
+        self.ballots_accepted += len(x.iteration_data.ballots_truthful)
+
+    def result(self):
+        if self.num_elections == 0:
+            return None
+        avg_ballots_sampled = self.ballots_sampled / self.num_elections
+        percent_ballots_accepted = self.ballots_accepted / self.ballots_sampled * 100
+        return GenerationStats(avg_ballots_sampled,percent_ballots_accepted)
+
+# all available stats of a batch of elections, depending on domain
+class StatsAccumulator:
+    def __init__(self, ordinal, keep_data=True):
+        self.ordinal = ordinal
+        self.indices = [] if keep_data else None
+        self.iteration = IterationAccumulator(keep_data)
+        self.generation = GenerationAccumulator()
+        if ordinal:
+            self.psc = PSCAccumulator(keep_data)
+        else:
+            self.welfare = WelfareAccumulator()
+            self.jr = RepresentationAccumulator(JRStats,keep_data)
+            self.ejrplus = RepresentationAccumulator(EJRPlusStats,keep_data)
+
+    @property
+    def num_elections(self):
+        return self.iteration.num_elections
+
+    def add(self, x: ElectionData):
+        if self.indices is not None:
+            self.indices.append(x.election_index)
+        self.iteration.add(x.iteration_data)
+        self.generation.add(x)
+        if self.ordinal:
+            self.psc.add(x.psc_data)
+        else:
+            self.welfare.add(x.iteration_data)
+            self.jr.add(x.jr_data)
+            self.ejrplus.add(x.ejrplus_data)
+
+    def result(self):
+        # kept data in order of election indices
+        if self.indices is not None:
+            order = sorted(range(len(self.indices)),key=self.indices.__getitem__)
+            for accumulator in [self.iteration] + ([self.psc] if self.ordinal else [self.jr,self.ejrplus]):
+                accumulator.all_data = [accumulator.all_data[j] for j in order]
+            self.indices = [self.indices[j] for j in order]
+        if self.ordinal:
+            return Stats(self.iteration.result(),self.psc.result(),None,None,None,self.generation.result())
+        return Stats(self.iteration.result(),None,self.welfare.result(),self.jr.result(),self.ejrplus.result(),self.generation.result())
+
+# calculate all available stats from list of data from single elections, depending on domain
 def get_stats(n,ordinal,election_data_list: list[ElectionData]):
-    iteration_stats = get_iteration_stats([x.iteration_data for x in election_data_list])
-    if ordinal:
-        psc_stats = get_psc_stats([x.psc_data for x in election_data_list])
-        return Stats(iteration_stats,psc_stats,None,None,None)
-    else: 
-        welfare_stats = get_welfare_stats(n,[x.iteration_data for x in election_data_list])
-        jr_stats = get_jr_stats([x.jr_data for x in election_data_list])
-        ejrplus_stats = get_ejrplus_stats([x.ejrplus_data for x in election_data_list])
-        return Stats(iteration_stats,None,welfare_stats,jr_stats,ejrplus_stats)
+    accumulator = StatsAccumulator(ordinal)
+    for x in election_data_list:
+        accumulator.add(x)
+    return accumulator.result()
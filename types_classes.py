@@ -1,7 +1,9 @@
-from dataclasses import dataclass, is_dataclass
+from dataclasses import dataclass, field, is_dataclass
 from typing import Literal
 import sys,math
 
+from bitmasks import BallotProfile, Trajectory, from_mask
+
 # INPUT PARAMETERS
 @dataclass
 class BallotGenerationParams:
@@ -36,6 +38,28 @@ class DeviationParams:
     swap_j: int
     set_preference: Literal["AV","CCAV","kelly","fishburn","PD"]
     skip_ties: bool
+    # use best-response oracles to restrict the ballot space where available (see oracles.py)
+    best_response_oracle: bool = False
+
+# execution only, does not change results (seed selects the random streams of the elections)
+@dataclass
+class ExecutionParams:
+    # number of slots of the committee cache shared between pool workers (0: disabled)
+    shared_cache_size: int = 2**20
+    # SQLite file storing computed committees across runs (None: disabled) and its maximum number of committees
+    committee_store: str = None
+    committee_store_max_entries: int = 10**8
+    # keep data of single elections in stats (all_*_data), otherwise only aggregated stats and the streamed log
+    keep_election_data: bool = True
+    # seconds between checkpoints of the result store (finished elections are kept when a run is restarted)
+    checkpoint_interval: float = 300
+    # master seed of the per-election random streams (None: unseeded, not reproducible)
+    seed: int = None
+    # (shard, number of shards): only run a contiguous range of election indices, stored separately (merged by a run without shard)
+    shard: tuple[int,int] = None
+    # committees of test ballots kept per process for reuse against the same other ballots (0: disabled, see deviations.py),
+    # applies to each pool worker, about 110 bytes per committee (measured with tracemalloc): 2**19 is ~60 MB per worker
+    response_cache_entries: int = 2**19
 
 @dataclass
 class Parameters:
@@ -46,6 +70,7 @@ class Parameters:
     deviation: DeviationParams
     trace: bool
     filename: str
+    execution: ExecutionParams = field(default_factory=ExecutionParams)
 
 # OUTPUT DATA (for a single instance)
 # use list of _Data, calculate necessary stats after all elections
@@ -60,9 +85,9 @@ class IterationData:
     committee_truthful: set[int]
     committee_final: set[int]
     manipulators: set[int]
-    # all deviations and committees
-    # format: (voter,new ballots,new committee)
-    all_deviations: list[(int,list[set[int]],set[int])]
+    # all deviations and committees, stored as deltas to the truthful ballots
+    # entries: (voter,new ballots,new committee)
+    all_deviations: Trajectory
 
 @dataclass
 class PSCData:
@@ -97,6 +122,28 @@ class ElectionData:
     psc_data: PSCData
     jr_data: JRData
     ejrplus_data: EJRPlusData
+    # ballots sampled to generate the truthful profile (rejection sampling, None for manual profiles)
+    ballots_sampled: int = None
+
+# all profiles reachable from the truthful profile by deviations of get_deviation (see explorer.py)
+# complete: all reachable profiles were explored, otherwise can_cycle/converges_from_all are None if not decided
+@dataclass
+class ExplorationData:
+    election_index: int
+    ballots_truthful: BallotProfile
+    complete: bool
+    num_profiles: int
+    num_deviations: int
+    # maximum number of deviations needed to reach a profile
+    depth: int
+    # profiles without improving deviation: (ballots, committee, number of deviations from the truthful profile)
+    equilibria: list[(BallotProfile,set[int],int)]
+    # sizes of strongly connected components with more than one profile, components without deviation leaving them
+    cycle_sizes: list[int]
+    closed_cycles: int
+    can_cycle: bool
+    # an equilibrium can be reached from every reachable profile
+    converges_from_all: bool
 
 # STATS (for a batch of elections with the same parameters)
 @dataclass
@@ -147,6 +194,12 @@ class PSCStats:
     avg_size_psc_violation_F: float
     all_psc_data: list[PSCData]
 
+# Generation: acceptance of sampled ballots (skip_empty_ballots), only generated cultures
+@dataclass
+class GenerationStats:
+    avg_ballots_sampled: float
+    percent_ballots_accepted: float
+
 # contains all stats for a batch of elections (wrapper for different stat types)
 @dataclass
 class Stats:
@@ -155,15 +208,18 @@ class Stats:
     welfare_stats: WelfareStats
     jr_stats: JRStats
     ejrplus_stats: EJRPlusStats
+    generation_stats: GenerationStats = None
 
 # PRINTING
 def print_deviations(deviations, add_str="", file=sys.stdout):
     print(add_str + "Deviations:",file=file)
     add_str += "\t"
-    for i in range(len(deviations)):
-        voter, ballots, comittee = deviations[i]
-        ballot_old = "" if i==0 else str(deviations[i-1][1][voter])
-        print(add_str + f"Voter {voter}:        \t{ballot_old} -> {ballots[voter]}\n{add_str}  New Ballots:  \t{ballots}\n{add_str}  New Committee:\t{comittee}",file=file)
+    # profiles of a trajectory are rebuilt one after the other
+    ballots_previous = None
+    for i, (voter, ballots, comittee) in enumerate(deviations):
+        ballot_old = "" if i==0 else str(from_mask(ballots_previous[voter]))
+        ballots_previous = ballots
+        print(add_str + f"Voter {voter}:        \t{ballot_old} -> {from_mask(ballots[voter])}\n{add_str}  New Ballots:  \t{ballots}\n{add_str}  New Committee:\t{comittee}",file=file)
 
 def print_dataclass(d,noprint={"all_iteration_data","all_ejrplus_data","all_jr_data","all_psc_data"},print_None=False,add_str="",file=sys.stdout):
     for key, value in d.__dict__.items():
@@ -181,21 +237,19 @@ def print_dataclass(d,noprint={"all_iteration_data","all_ejrplus_data","all_jr_d
                 else:
                     print(add_str + key + " " + tabs + str(value),file=file)
 
-# write full log from all elections to file
-def write_log(stats,parameters):
-    with open(parameters.filename + "/full_log.txt", "a") as f:
-        for i in range(len(stats.iteration_stats.all_iteration_data)):
-            print("PROFILE " + str(i) + ":",file=f)
-            print_dataclass(stats.iteration_stats.all_iteration_data[i],add_str="  ",noprint=set(),file=f)
-            if parameters.ballot_generation.ordinal:
-                if stats.psc_stats.all_psc_data[i].coalition_T != set() or stats.psc_stats.all_psc_data[i].coalition_F != set():
-                    print("PSC violated",file=f)
-                    print_dataclass(stats.psc_stats.all_psc_data[i],add_str="  ",noprint=set(),print_None=True,file=f)
-            else:
-                if stats.ejrplus_stats.all_ejrplus_data[i].candidate_T != None or stats.ejrplus_stats.all_ejrplus_data[i].candidate_F != None:
-                    print("EJR+ violated",file=f)
-                    print_dataclass(stats.ejrplus_stats.all_ejrplus_data[i],add_str="  ",noprint=set(),print_None=True,file=f)
-                if stats.jr_stats.all_jr_data[i].candidate_T != None or stats.jr_stats.all_jr_data[i].candidate_F != None:
-                    print("JR violated",file=f)
-                    print_dataclass(stats.jr_stats.all_jr_data[i],add_str="  ",noprint=set(),print_None=True,file=f)
-            print("-------------------------------------------------",file=f)
\ No newline at end of file
+# write log of a single election to open file (called as soon as the election is finished)
+def write_election_log(election_data:ElectionData,ordinal,f):
+    print("PROFILE " + str(election_data.election_index) + ":",file=f)
+    print_dataclass(election_data.iteration_data,add_str="  ",noprint=set(),file=f)
+    if ordinal:
+        if election_data.psc_data.coalition_T != set() or election_data.psc_data.coalition_F != set():
+            print("PSC violated",file=f)
+            print_dataclass(election_data.psc_data,add_str="  ",noprint=set(),print_None=True,file=f)
+    else:
+        if election_data.ejrplus_data.candidate_T != None or election_data.ejrplus_data.candidate_F != None:
+            print("EJR+ violated",file=f)
+            print_dataclass(election_data.ejrplus_data,add_str="  ",noprint=set(),print_None=True,file=f)
+        if election_data.jr_data.candidate_T != None or election_data.jr_data.candidate_F != None:
+            print("JR violated",file=f)
+            print_dataclass(election_data.jr_data,add_str="  ",noprint=set(),print_None=True,file=f)
+    print("-------------------------------------------------",file=f)